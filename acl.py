@@ -7,23 +7,42 @@ to maintain an ACL database.
 
 """
 from lib import *
+from collections import OrderedDict
+import multiprocessing
+import glob
+import mmap
+import os
+import pickle
 import re
+import socket
 import sys
 
 # decorator function
 def addMoreInfo(c):
     class X(c):
-        def __init__(self, *pargs, lineNumber=0, code=None, comment=None, **kargs):
+        def __init__(self, *pargs, lineNumber=0, code=None, comment=None,
+                     source=None, **kargs):
             c.__init__(self, *pargs, **kargs)
             self.lineNumber = lineNumber
             self.code       = code
             self.comment    = comment
+            self.source     = source    # file path of a shard
+    # take the place of the decorated class, so that the
+    # objects can be pickled and sent to worker processes
+    X.__name__     = c.__name__
+    X.__qualname__ = c.__qualname__
+    X.__module__   = c.__module__
     return X
 
 
+# the IPv6 addresses are taken as integers above all the IPv4
+# ones, an IPv6 address is its 128-bit value plus ipv6Base, thus
+# the networks of the two families are intervals that never meet
+ipv6Base = 1 << 128
+
 @addMoreInfo
 class Network(Leaf):
-    """ Represents an IPv4 network
+    """ Represents an IPv4 or IPv6 network
     """
     LESS        = -1
     EQUAL       = 0
@@ -32,37 +51,21 @@ class Network(Leaf):
 
     def __init__(self, name):
         Leaf.__init__(self, name)
-        pattern  = '^([0-9]+\.){3}[0-9]+/[0-9]+$'
-        if not re.match(pattern, name):
-            msg =  "invalid network: %s\n" % name
-            msg += "valid forms: 1.2.3.4/32, 1.2.3.0/24, ..."
-            raise InvalidNetworkException(msg)
         self.parseNetwork()
 
     def parseNetwork(self):
         """ Parse the given network, convert the 'net' to the actual network
         id thus 192.168.1.3/24 will be converted to 192.168.1.0/24, store
         the string representation of the network, and the integer form of the
-        first ip and the last ip.
-        """
-        net        = self.name
-        parts      = net.split('/')
-        numbers    = parts[0].split('.')
-        binNumbers = ['%08d' % int(bin(int(n))[2:]) for n in numbers]
-        binNumStr  = ''.join(binNumbers)
-        maskLen    = int(parts[1])
-        netPartStr = binNumStr[:maskLen]
-        padCount   = 32 - maskLen
-        firstIpBin = netPartStr + '0' * padCount
-        lastIpBin  = netPartStr + '1' * padCount
-        self.firstInt = int(firstIpBin, base=2)
-        self.lastInt  = int(lastIpBin, base=2)
-        netIdStr = firstIpBin
-        netIdEle = []
-        while netIdStr:
-            s, netIdStr = netIdStr[:8], netIdStr[8:]
-            netIdEle.append(str(int(s, base=2)))
-        self.name = '%s/%s' % ('.'.join(netIdEle), maskLen)
+        first ip and the last ip, see parseCidr.
+        """
+        net = parseCidr(self.name)
+        if net is None:
+            msg =  "invalid network: %s\n" % self.name
+            msg += "valid forms: 1.2.3.4/32, 1.2.3.0/24, 2001:db8::/32, ..."
+            raise InvalidNetworkException(msg)
+        self.firstInt, self.lastInt = net
+        self.name = Network.formatNetwork(*net)
 
     def compare(self, net):
         """ Compare self with the given network, return
@@ -79,6 +82,30 @@ class Network(Leaf):
             return Network.GREATER
         return Network.NOCOMMON
 
+    def sibling(self, net):
+        """ Return True if self and the given network are the
+        two halves of a larger network, self being the lower
+        half, thus 192.168.2.0/24 is the sibling of the
+        192.168.3.0/24, but not of the 192.168.1.0/24.
+        """
+        size = self.lastInt - self.firstInt + 1
+        return (net.lastInt - net.firstInt + 1 == size and
+                self.lastInt + 1 == net.firstInt and
+                self.firstInt % (size * 2) == 0)
+
+    @staticmethod
+    def formatNetwork(firstInt, lastInt):
+        """ Return the string form of the network which
+        spans from the firstInt to the lastInt.
+        """
+        size = lastInt - firstInt + 1
+        if firstInt >= ipv6Base:
+            maskLen = 129 - size.bit_length()
+            return '%s/%s' % (formatIpv6(firstInt - ipv6Base), maskLen)
+        maskLen = 33 - size.bit_length()
+        numbers = [str((firstInt >> s) & 0xff) for s in (24, 16, 8, 0)]
+        return '%s/%s' % ('.'.join(numbers), maskLen)
+
 
 @addMoreInfo
 class Acl(Branch):
@@ -116,24 +143,27 @@ class Acl(Branch):
             192.168.1.0/24;
             192.168.0.0/16;
 
-        shall produce a result of [192.168.0.0/16]
+        shall produce a result of [192.168.0.0/16]. Networks
+        never partially overlap, so in the order of (first
+        address, -last address), every network is covered by
+        the last uncovered one before it, if by any. A larger
+        network takes the place of the first one it covers.
         """
+        order = sorted(range(len(networks)),
+                       key=(lambda i: (networks[i].firstInt, -networks[i].lastInt)))
+        cover = {}      # index -> index of the covering network
+        last  = None
+        for i in order:
+            if last is not None and networks[i].lastInt <= networks[last].lastInt:
+                cover[i] = last
+            else:
+                cover[i] = last = i
         nonredundant_nets = []
-        reduced_networks = networks[:]
-        for net1 in networks:
-            # net1 may be removed from the reduced_networks in
-            # the previous iteration, shall not process it again
-            if net1 not in reduced_networks: continue
-
-            reduced_networks.pop(0)
-            inner_networks = reduced_networks[:]
-            for net2 in inner_networks:
-                r = net1.compare(net2)
-                if r == Network.LESS:       # keep the greater
-                    net1 = net2
-                if r != Network.NOCOMMON:   # remove the processed
-                    reduced_networks.remove(net2)
-            nonredundant_nets.append(net1)
+        taken = set()
+        for i in range(len(networks)):
+            if cover[i] not in taken:
+                taken.add(cover[i])
+                nonredundant_nets.append(networks[cover[i]])
         return nonredundant_nets
 
     def removeRedundant(self):
@@ -141,8 +171,51 @@ class Acl(Branch):
         """
         uniqNets      = self.directUniqNetworks()
         directSubAcls = [x for x in self.childNodes if isinstance(x, Acl)]
+        self.touch()
         self.childNodes = directSubAcls + uniqNets
 
+    def aggregate(self, taken=()):
+        """ Merge the sibling networks directly attached to the
+        ACL into their minimal CIDR cover, these two networks
+
+            192.168.2.0/24;
+            192.168.3.0/24;
+
+        shall be replaced by 192.168.2.0/23. A merged network
+        takes the line number of its first part, and the
+        comments of all its parts. A name in 'taken' is never
+        used for a merged network. Return two lists, the removed
+        networks and the added ones.
+        """
+        nets  = [x for x in self.childNodes if isinstance(x, Network)]
+        nets  = sorted(nets, key=(lambda x: (x.firstInt, -x.lastInt)))
+        stack = []
+        for net in nets:
+            stack.append(net)
+            while len(stack) > 1 and stack[-2].sibling(stack[-1]):
+                net0, net1 = stack[-2:]
+                name = Network.formatNetwork(net0.firstInt, net1.lastInt)
+                if name in taken:
+                    break
+                comments = []
+                for x in (net0.comment, net1.comment):
+                    if x and x not in comments:
+                        comments.append(x)
+                code   = '%s+%s' % (net0.code or net0.name, net1.code or net1.name)
+                cmnt   = b' '.join(comments) if comments else None
+                merged = Network(name, lineNumber=net0.lineNumber,
+                                 code=code, comment=cmnt)
+                stack[-2:] = [merged]
+        kept    = set(stack)
+        origin  = set(nets)
+        removed = [x for x in nets if x not in kept]
+        added   = [x for x in stack if x not in origin]
+        for net in removed:
+            self.detachChild(net, sure=True)
+        for net in added:
+            self.attachChild(net)
+        return (removed, added)
+
     def compare(self, acl):
         """ Compare self with the given acl, return
         Acl.LESS if self is covered by the acl
@@ -150,10 +223,23 @@ class Acl(Branch):
         Acl.OTHER if the two are the same,
                   or has no common portion
         """
-        l_rela    = []
-        g_rela    = []
-        networks1 = self.networks()
-        networks2 = acl.networks()
+        return Acl.relationOf(*self.relations(acl))
+
+    def relations(self, acl):
+        """ Compare every network of self with the ones of
+        the given acl, return two lists of network pairs,
+        (net1, net2), net1 of self, net2 of the acl, in the
+        first list net1 is LESS than net2, in the second one
+        net1 is GREATER than net2.
+        """
+        return Acl.netRelations(self.networks(), acl.networks())
+
+    @staticmethod
+    def netRelations(networks1, networks2):
+        """ The relations method on two lists of networks
+        """
+        l_rela = []
+        g_rela = []
         for net1 in networks1:
             for net2 in networks2:
                 r = net1.compare(net2)
@@ -161,6 +247,13 @@ class Acl(Branch):
                     g_rela.append((net1, net2))
                 elif r == Network.LESS:
                     l_rela.append((net1, net2))
+        return (l_rela, g_rela)
+
+    @staticmethod
+    def relationOf(l_rela, g_rela):
+        """ The relation of two acls of the network pairs
+        returned by the relations method, see compare.
+        """
         assert not (len(l_rela) and len(g_rela)), "Acl database error"
         if len(l_rela):
             return Acl.LESS
@@ -170,10 +263,11 @@ class Acl(Branch):
             return Acl.OTHER
 
     @staticmethod
-    def splitTree(nets):
+    def splitTree(nets, lineage=None):
         """ For every network in the 'nets', split all ACLs
         in the line from the network up to the 'TOP' which
-        has no parent.
+        has no parent. Every split is recorded in the
+        'lineage' if it's provided.
 
         Example: Split net1, net3, net5, net6 out.
 
@@ -191,42 +285,189 @@ class Acl(Branch):
               net6──┘                       net6──┘
 
         """
-        new_acls = {}
-        res_acls = []
-        for net in nets:
-            node   = net
-            parent = node.parent
-            while True:         # split all parents up the line
-                if len(parent.childNodes) == 1:
-                    node   = parent
-                    parent = node.parent
-                    continue
-                if parent.name[-2:] == '-0':
-                    # when process another net in the same
-                    # method call, branch1 may already be
-                    # created when processed a previous net.
-                    branch1_name = parent.name[:-1] + '1'
-                    if branch1_name in new_acls:
-                        new_acls[branch1_name].moveChild(node)
+        with Tracer.begin('splitTree', 'split', nets=len(nets)) as span:
+            new_acls = {}   # branch0 -> branch1
+            res_acls = []
+            for net in nets:
+                node   = net
+                parent = node.parent
+                while True:         # split all parents up the line
+                    if len(parent.childNodes) == 1:
+                        node   = parent
+                        parent = node.parent
+                        continue
+                    if parent in new_acls:
+                        # when process another net in the same
+                        # method call, branch1 may already be
+                        # created when processed a previous net.
+                        new_acls[parent].moveChild(node)
                         break
-                # split
-                branch1_name = parent.name + '-1'
-                branch1 = Acl(branch1_name)
-                branch1.moveChild(node)
-                new_acls[branch1.name] = branch1 # another net may want it
-                branch0_name = parent.name + '-0'
-                parent.rename(branch0_name)
-                branch0 = parent
-                node   = branch1
-                parent = branch0.parent
-                if parent:
-                    parent.attachChild(branch1)
-                else:   # splitting hit the top, done
-                    res_acls = [branch0, branch1]
-                    break
+                    # split
+                    branch1_name = parent.name + '-1'
+                    branch1 = Acl(branch1_name, source=parent.source)
+                    branch1.moveChild(node)
+                    new_acls[parent] = branch1 # another net may want it
+                    branch0_name = parent.name + '-0'
+                    if lineage is not None:
+                        lineage.split(parent.name, branch0_name, branch1_name)
+                    parent.rename(branch0_name)
+                    branch0 = parent
+                    node   = branch1
+                    parent = branch0.parent
+                    if parent:
+                        parent.attachChild(branch1)
+                    else:   # splitting hit the top, done
+                        res_acls = [branch0, branch1]
+                        break
+            if span:
+                span.args['acls']  = [x.name for x in res_acls]
+                span.args['split'] = len(new_acls)
         return res_acls
 
 
+    @staticmethod
+    def mergeTree(acl0, acl1, name, lineage=None):
+        """ Merge two sibling parts made by splitTree back into
+        one, all children of acl1 are moved to acl0, except for
+        a sub acl whose sibling is in acl0, like C-1 to C-0, it
+        is merged into the sibling likewise. acl0 is renamed to
+        'name' and returned, the merge is recorded in 'lineage'
+        if it's provided, the siblings are found by its records
+        then, see Lineage.mergedName.
+        """
+        if lineage is None:
+            lineage = Lineage()
+        subacls = dict([(x.name, x) for x in acl0.childNodes
+                            if isinstance(x, Acl)])
+        for child in list(acl1.childNodes):
+            sibling = None
+            if isinstance(child, Acl):
+                sibling = subacls.get(lineage.siblingOf(child.name))
+            if sibling is not None:
+                subName = lineage.mergedName(sibling.name, child.name)
+                acl1.detachChild(child, sure=True)
+                Acl.mergeTree(sibling, child, subName, lineage)
+            else:
+                acl0.moveChild(child)
+        recorded = acl0.name in lineage.origin or acl1.name in lineage.origin
+        if not lineage.merge(acl0.name, acl1.name, name) and recorded:
+            raise Exception("%s and %s are not parts of one acl" % (
+                                acl0.name, acl1.name))
+        acl0.rename(name)
+        acl0.removeRedundant()
+        return acl0
+
+
+class RelationCache:
+    """ Cache of the relations of acl pairs. The networks of
+    every acl are kept with the range of addresses they span,
+    two acls whose ranges don't meet are related to nothing,
+    which is known at once. For the others, the network pairs
+    found by Acl.relations are kept for the pair of acls, along
+    with the versions of the two, any change of an acl or its
+    sub acls changes its version (see lib.Node.touch), which
+    makes the entries of it stale, they are computed again
+    when asked. An entry answers for the two acls in both
+    orders. At most 'limit' pairs, and 'limit' acls of the
+    networks, are kept, the least recently used ones are
+    dropped first.
+    """
+    limit = 100000
+
+    def __init__(self):
+        self.data     = OrderedDict()   # (acl1, acl2) -> (ver1, ver2, l_rela, g_rela)
+        self.spans    = OrderedDict()   # acl -> (version, networks, first, last)
+        self.disjoint = 0
+        self.hits     = 0
+        self.misses   = 0
+        self.stale    = 0
+
+    def networks(self, acl):
+        """ Return the networks of the acl, and the first and
+        the last address of them, None for an empty acl.
+        """
+        entry = self.spans.get(acl)
+        if entry is None or entry[0] != acl.version:
+            nets = acl.networks()
+            if nets:
+                span = (min([x.firstInt for x in nets]),
+                        max([x.lastInt for x in nets]))
+            else:
+                span = (None, None)
+            entry = (acl.version, nets) + span
+            self.spans[acl] = entry
+            if len(self.spans) > self.limit:
+                self.spans.popitem(last=False)
+        self.spans.move_to_end(acl)     # recently used
+        return entry[1:]
+
+    def relations(self, acl1, acl2):
+        """ Return the network pairs of the acl1 and acl2,
+        as Acl.relations does.
+        """
+        nets1, first1, last1 = self.networks(acl1)
+        nets2, first2, last2 = self.networks(acl2)
+        if not nets1 or not nets2 or last1 < first2 or last2 < first1:
+            self.disjoint += 1
+            return ([], [])
+
+        swap  = (lambda rela: [(y, x) for x, y in rela])
+        key   = (acl1, acl2)
+        entry = self.data.get(key)
+        if entry is None:
+            key   = (acl2, acl1)
+            entry = self.data.get(key)
+            if entry is not None:   # kept in the reverse order
+                ver2, ver1, g_rela, l_rela = entry
+                entry = (ver1, ver2, swap(l_rela), swap(g_rela))
+        if entry is not None:
+            if entry[0] == acl1.version and entry[1] == acl2.version:
+                self.hits += 1
+                self.data.move_to_end(key)  # recently used
+                return entry[2:]
+            self.stale += 1
+            del self.data[key]
+        self.misses += 1
+        l_rela, g_rela = Acl.netRelations(nets1, nets2)
+        self.data[(acl1, acl2)] = (acl1.version, acl2.version, l_rela, g_rela)
+        if len(self.data) > self.limit:
+            self.data.popitem(last=False)
+        return (l_rela, g_rela)
+
+    def compare(self, acl1, acl2):
+        """ Return the relation of acl1 to acl2, as
+        Acl.compare does.
+        """
+        return Acl.relationOf(*self.relations(acl1, acl2))
+
+    def nets(self, acl1, acl2, relation):
+        """ Return the networks of acl1 that have the
+        'relation', Network.LESS or Network.GREATER, with
+        any network of acl2, in the order of acl1.networks.
+        """
+        l_rela, g_rela = self.relations(acl1, acl2)
+        rela = l_rela if relation == Network.LESS else g_rela
+        return AclGroup.uniqFirst(rela)
+
+    def add(self, disjoint, hits, misses, stale):
+        """ Add the metrics of another cache, the one of
+        a worker process for example.
+        """
+        self.disjoint += disjoint
+        self.hits     += hits
+        self.misses   += misses
+        self.stale    += stale
+
+    def stats(self):
+        """ Return the metrics as a text
+        """
+        total = self.disjoint + self.hits + self.misses
+        rate  = (self.disjoint + self.hits) * 100 / total if total else 0
+        return ('%s disjoint, %s hits, %s misses, %s stale, '
+                'hit rate %.1f%%' % (self.disjoint, self.hits,
+                    self.misses, self.stale, rate))
+
+
 class AclDbFormat:
     """ Define the acceptable format of
     lines for the ACL database file.
@@ -237,6 +478,7 @@ class AclDbFormat:
     NETWORK  = 4
     SUBACL   = 5
     OTHER    = 6
+    INCLUDE  = 7
 
     def match(self, line):
         """ Identify the type of the line
@@ -244,6 +486,10 @@ class AclDbFormat:
         if re.search(b'^\s*#', line):
             self.matchData = None
             return self.COMMENT
+        match = re.search(b'^\s*include\s+"([^"]+)"\s*;', line)
+        if match:
+            self.matchData = match.group(1).decode()
+            return self.INCLUDE
         if b'acl' in line:
             self.matchData   = line.split(b'"')[1].decode()
             self.commentData = self.extractComment(line)
@@ -251,7 +497,8 @@ class AclDbFormat:
         if line == b'};\n':
             self.matchData = None
             return self.ACLEND
-        match = re.search(b'^\s*(ecs )?\s*(([0-9]+\.){3}[0-9]+/[0-9]+)', line)
+        match = re.search(b'^\s*(ecs )?\s*(([0-9]+\.){3}[0-9]+/[0-9]+'
+                          b'|[0-9a-fA-F:.]*:[0-9a-fA-F:.]*/[0-9]+)', line)
         if match:
             self.matchData   = match.group(2).decode()
             self.commentData = self.extractComment(line)
@@ -273,6 +520,167 @@ class AclDbFormat:
             return None
 
 
+def scanAclDb(path):
+    """ Read the ACL database file line by line, yield a token
+    for every line, a token is a tuple of (type, lineNumber,
+    data, comment), of the type defined by the AclDbFormat,
+    the ending of an acl and the comments other than the
+    lineage records are left out. A syntax error is yielded
+    as a token of the type OTHER, the data is the line.
+    """
+    with open(path, 'rb') as f:
+        yield from scanAclLines(f)
+
+
+def scanAclLines(lines, start=1):
+    """ Yield the tokens of the lines, which are bytes, the
+    first one is numbered 'start', see scanAclDb.
+    """
+    fmt = AclDbFormat()
+    for num, line in enumerate(lines, start):
+        kind = fmt.match(line)
+        if kind == AclDbFormat.COMMENT:
+            if line.startswith(Lineage.prefix):
+                yield (kind, num, line, None)
+        elif kind in (AclDbFormat.ACLSTART, AclDbFormat.NETWORK):
+            yield (kind, num, fmt.matchData, fmt.commentData)
+        elif kind in (AclDbFormat.SUBACL, AclDbFormat.INCLUDE):
+            yield (kind, num, fmt.matchData, None)
+        elif kind == AclDbFormat.OTHER:
+            yield (kind, num, line, None)
+
+
+def tokenizeAclDb(path):
+    """ Read the ACL database file, return a tuple of the path,
+    a list of tokens and a list of syntax errors, the tokens
+    are the ones of scanAclDb. An error is a tuple of
+    (lineNumber, line). It's a plain function, for running
+    in worker processes.
+    """
+    tokens = []
+    errors = []
+    for token in scanAclDb(path):
+        if token[0] == AclDbFormat.OTHER:
+            errors.append(token[1:3])
+        else:
+            tokens.append(token)
+    return (path, tokens, errors)
+
+
+cidrPattern = re.compile('^([0-9]+)\\.([0-9]+)\\.([0-9]+)\\.([0-9]+)/([0-9]+)$')
+cidr6Pattern = re.compile('^([0-9a-fA-F:.]*:[0-9a-fA-F:.]*)/([0-9]+)$')
+
+def parseCidr(text):
+    """ Parse the network 'text' of the form 1.2.3.0/24 or
+    2001:db8::/32 to integers without creating a Network,
+    the network is normalized, thus 10.1.1.3/24 is taken
+    as 10.1.1.0/24. Return a tuple of (firstInt, lastInt),
+    or None if the text is not a valid network. An IPv6
+    network is offset by ipv6Base.
+    """
+    match = cidrPattern.match(text)
+    if not match:
+        match = cidr6Pattern.match(text)
+        if not match:
+            return None
+        ip = parseAddress(match.group(1))
+        maskLen = int(match.group(2))
+        if ip is None or ip < ipv6Base or maskLen > 128:
+            return None
+        hostMask = (1 << (128 - maskLen)) - 1
+        firstInt = ip & ~hostMask
+        return (firstInt, firstInt | hostMask)
+    numbers = [int(x) for x in match.groups()]
+    maskLen = numbers.pop()
+    if maskLen > 32 or max(numbers) > 255:
+        return None
+    ip = 0
+    for n in numbers:
+        ip = (ip << 8) + n
+    hostMask = (1 << (32 - maskLen)) - 1
+    firstInt = ip & ~hostMask
+    return (firstInt, firstInt | hostMask)
+
+
+def parseAddress(text):
+    """ Parse the address 'text' of the form 1.2.3.4 or
+    2001:db8::1 to an integer, an IPv6 address is offset
+    by ipv6Base, return None if it's not a valid address.
+    """
+    try:
+        if ':' in text:
+            return ipv6Base + int.from_bytes(
+                        socket.inet_pton(socket.AF_INET6, text), 'big')
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, text), 'big')
+    except (OSError, ValueError):
+        return None
+
+
+def formatIpv6(ip):
+    """ Return the text of the IPv6 address 'ip', an int not
+    offset, in the form of RFC 5952: lower case, no leading
+    zeros, the longest run of two or more zero groups, the
+    first of the longest ones, is shortened to '::', and an
+    IPv4-mapped address ends with the dotted quad.
+    """
+    groups = [(ip >> s) & 0xffff for s in range(112, -16, -16)]
+    if groups[:6] == [0, 0, 0, 0, 0, 0xffff]:
+        return '::ffff:%s.%s.%s.%s' % (groups[6] >> 8, groups[6] & 0xff,
+                                        groups[7] >> 8, groups[7] & 0xff)
+    start, length, run = 0, 1, 0
+    for idx, group in enumerate(groups):
+        run = run + 1 if group == 0 else 0
+        if run > length:
+            start, length = idx - run + 1, run
+    texts = ['%x' % x for x in groups]
+    if length < 2:
+        return ':'.join(texts)
+    return ':'.join(texts[:start]) + '::' + ':'.join(texts[start + length:])
+
+
+def readNetworkList(path):
+    """ Read a network list file, every line of it is in the
+    form 'view,cidr[,comment]', fields are separated by tabs
+    if there is any, otherwise by commas, empty lines and
+    lines start with '#' are ignored. The networks are parsed
+    by parseCidr. Return a list of rows and a list of errors,
+    a row is a tuple of (view, firstInt, lastInt, code,
+    comment, lineNumber), the code is the cidr as it is in
+    the file. An error is a tuple of (lineNumber, line).
+    """
+    rows    = []
+    errors  = []
+    for num, line in enumerate(open(path), 1):
+        text = line.strip()
+        if not text or text.startswith('#'):
+            continue
+        sep    = '\t' if '\t' in text else ','
+        fields = [x.strip() for x in text.split(sep, 2)]
+        net    = parseCidr(fields[1]) if len(fields) > 1 else None
+        if not fields[0] or not net:
+            errors.append((num, line))
+            continue
+        comment = ('# ' + fields[2]).encode() if len(fields) > 2 and fields[2] else None
+        rows.append((fields[0], net[0], net[1], fields[1], comment, num))
+    return (rows, errors)
+
+
+class StampedDict(dict):
+    """ A dict that remembers the stamp current when a value
+    is set, along with the value, in self.stamps. A value set
+    again under the same key keeps the stamp it got first.
+    """
+    def __init__(self):
+        super().__init__()
+        self.stamp  = None
+        self.stamps = {}    # key -> (stamp, value)
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        if self.stamps.get(key, (None, None))[1] is not value:
+            self.stamps[key] = (self.stamp, value)
+
+
 class AclGroup(TreeGroup):
     """ All nodes in the group are unique in name. A single network
     can overlap another network inside an Acl, like 7.7.0.0/16 overlaps
@@ -304,7 +712,33 @@ class AclGroup(TreeGroup):
     # control how verbose the program will be
     verbose = 0     # only shows error message
 
-    def load(self, dbFile, ignore_syntax=True, remove_conflict=True):
+    # the strategy to resolve a coexist problem, every name
+    # refers to a method named as <name>Strategy
+    strategies = ('greedy', 'minsplit')
+    strategy   = 'greedy'
+
+    # the minsplit strategy tries all combinations when
+    # an acl has no more than this number of conflicts
+    exactLimit = 12
+
+    # the tokens of the shards read, keyed by the real path, kept
+    # along with the size and the modification time of the file,
+    # the cache is off unless it's set to a dict
+    parseCache = None
+
+    # the splits made to resolve the conflicts of a component
+    # of acls, kept across runs, the cache is off unless it's
+    # set to a ResultCache, see removeConflicts
+    resultCache = None
+
+    def __init__(self):
+        TreeGroup.__init__(self)
+        self.lineage = Lineage()
+        self.queue   = WorkQueue()  # pending acls to be added
+        self.splits  = None         # the splits made, when it's a list
+
+    def load(self, dbFile, ignore_syntax=True, remove_conflict=True,
+             aggregate=False, jobs=None, only=None, journal=None):
         """ Load data from a database, the existing data of the group
         will be abandoned. Add in this manner: for each ACL, add all
         its networks to the group, and link all its networks with it,
@@ -319,56 +753,393 @@ class AclGroup(TreeGroup):
             acl "parent_acl" {
                 "sub_acl";
             };
+            include "other-acl.conf";
         A line starts with # is a comment, will be ignored, a line
         contains 'acl' is the start of an acl definition, a network
         definition is of form 0.0.0.0/0, sub acl's name must be
         quoted, other lines will be ignored.
 
+        The database may consist of shards: the 'dbFile' can be
+        a list of files, or a directory whose *.conf files are
+        the shards, and a shard can include another one, with a
+        path relative to the including shard. The shards are
+        tokenized in at most 'jobs' worker processes, then merged
+        in order, an included shard takes the place of the include
+        directive. Every node remembers its shard in the 'source'
+        attribute when there are more than one shard, the names
+        every shard includes are kept in self.includes, a dict
+        of the path of every shard to a list. A sub acl
+        is linked after all shards are read, so it can be defined
+        in another shard, or after the acl which references it.
+
         We delay the coexistent check after all the data are loaded,
         in order to preserve the relationship of acls, because the
         name of the acl will be changed when split it, thus break
-        the link with its parent.
+        the link with its parent. The parts of every split acl are
+        recorded in self.lineage, which is loaded from and saved
+        to the '#@lineage' comment lines of the database.
+
+        If 'aggregate' is True, the sibling networks of every acl
+        are merged into their minimal CIDR cover, the number of
+        saved entries is kept in self.savedCount.
+
+        If 'only' is a list of acl names, the ones the views use
+        for example, just the trees which contain these acls are
+        built, the other acls are kept in self.skipped as they
+        are, see readReachable. The conflicts can't be removed
+        in this case, the database shall be free of conflicts.
+
+        The networks added by 'add-net --journal' are replayed on
+        top of the database, before the conflicts are removed, the
+        'journal' is a list of the records, as Journal.read returns,
+        they are read from the journal of the database if it's None,
+        see journalPath.
         """
-        if not self.checkSyntax(dbFile) and not ignore_syntax:
+        assert only is None or not remove_conflict, "only a part is loaded"
+        if journal is None:
+            journal = Journal(self.journalPath(dbFile)).read()
+        self.skipped    = []
+        self.unreplayed = []
+        if only is None:
+            shards = self.readShards(self.shardPaths(dbFile), jobs)
+        else:
+            only = list(only) + [x['acl'] for num, x in journal]
+            shards, self.skipped = self.readReachable(
+                                        self.shardPaths(dbFile), only)
+        multi  = len(shards) > 1
+        stat   = True
+        for path, (tokens, errors) in shards.items():
+            for num, line in errors:
+                line = line.decode().rstrip('\n')
+                if multi:
+                    print('error: %s:%s:%s' % (path, num, line), file=sys.stderr)
+                else:
+                    print('error: %s:%s' % (num, line), file=sys.stderr)
+                stat = False
+        if not stat and not ignore_syntax:
             print('syntax error found in %s' % dbFile, file=sys.stderr)
             return False
 
-        self.data = {}
-        fmt       = AclDbFormat()
-        lines     = open(dbFile, 'rb').readlines()
-        acl       = None
-        for num, line in enumerate(lines, 1):
-            if fmt.match(line) == AclDbFormat.COMMENT:
-                continue
-            if fmt.match(line) == AclDbFormat.ACLSTART:
-                if acl:
-                    # remove redundant networks before adding
-                    acl.removeRedundant()
-                    self.addAcl(acl)
-                acl_name = fmt.matchData
-                cmnt     = fmt.commentData
-                acl      = Acl(acl_name, lineNumber=num, comment=cmnt)
-                continue
-            if fmt.match(line) == AclDbFormat.NETWORK:
-                net_name = fmt.matchData
-                cmnt     = fmt.commentData
-                net      = Network(net_name, lineNumber=num, code=net_name, comment=cmnt)
-                if self.addNetwork(net):
-                    acl.attachChild(net)
-                continue
-            if fmt.match(line) == AclDbFormat.SUBACL:
-                subacl_name = fmt.matchData
-                subacl      = self.getNode(subacl_name)
-                if subacl:
-                    acl.attachChild(subacl)
-                continue
-        if acl:
+        self.data       = {}
+        self.lineage    = Lineage()
+        self.includes   = dict([(x, []) for x in shards])
+        self.savedCount = 0
+        acls            = []    # all acls in the order of definition
+        subacls         = []    # (acl, name of the sub acl)
+        done            = set()
+
+        def build(path):
+            if path in done:
+                return
+            done.add(path)
+            source = path if multi else None
+            acl    = None
+            for kind, num, data, cmnt in shards[path][0]:
+                if kind == AclDbFormat.COMMENT:
+                    self.lineage.parseLine(data)
+                elif kind == AclDbFormat.ACLSTART:
+                    acl = Acl(data, lineNumber=num, comment=cmnt, source=source)
+                    acls.append(acl)
+                elif kind == AclDbFormat.NETWORK:
+                    net = Network(data, lineNumber=num, code=data,
+                                  comment=cmnt, source=source)
+                    if self.addNetwork(net):
+                        acl.attachChild(net)
+                elif kind == AclDbFormat.SUBACL:
+                    subacls.append((acl, data))
+                elif kind == AclDbFormat.INCLUDE:
+                    self.includes[path].append(data)
+                    build(self.includePath(path, data))
+
+        for path in list(shards):
+            build(path)
+
+        defined = {}
+        for acl in acls:
+            defined.setdefault(acl.name, acl)
+        for acl, name in subacls:
+            subacl = defined.get(name)
+            if subacl:
+                acl.attachChild(subacl)
+        self.replayJournal(journal, defined, self.journalPath(dbFile))
+        for acl in acls:
             # remove redundant networks before adding
             acl.removeRedundant()
+        if aggregate:
+            # all shards are read, the name of every network and
+            # every acl is known, none of them is taken by a merge
+            taken = set(self.data) | set(defined)
+            taken.update([x[0] for x in self.skipped])
+            for acl in acls:
+                self.aggregateAcl(acl, taken)
+        for acl in acls:
             self.addAcl(acl)
         if remove_conflict:
             self.removeConflicts()
 
+    @staticmethod
+    def shardPaths(dbFile):
+        """ Return a list of the shard files of the database,
+        which is a file, a directory, or a list of files.
+        """
+        if isinstance(dbFile, (list, tuple)):
+            return list(dbFile)
+        if os.path.isdir(dbFile):
+            paths = sorted(glob.glob(os.path.join(dbFile, '*.conf')))
+            assert paths, "no shard in %s" % dbFile
+            return paths
+        return [dbFile]
+
+    @staticmethod
+    def journalPath(dbFile):
+        """ Return the path of the journal of the database, the
+        file with '.journal' appended, or the 'journal' file in
+        the directory of shards, or the one of the first shard
+        if the database is a list of files.
+        """
+        if isinstance(dbFile, (list, tuple)):
+            dbFile = dbFile[0]
+        elif os.path.isdir(dbFile):
+            return os.path.join(dbFile, 'journal')
+        return dbFile + '.journal'
+
+    def replayJournal(self, journal, acls, path):
+        """ Add the networks of the journal records to the acls
+        of them, 'acls' is a dict of the acls by name. A record
+        is a dict of the acl name, the view name and the names
+        of the networks, the acl of the view when it's appended.
+        A network already in the group is reported as a duplicate
+        as the ones in the database. The records whose acl is not
+        found are reported, and kept in self.unreplayed, a command
+        that folds the journal shall not go on with any of them.
+        """
+        self.unreplayed = []
+        for num, record in journal:
+            acl = acls.get(record['acl'])
+            if acl is None:
+                print('error: %s:%s: acl not exists: %s' %
+                        (path, num, record['acl']), file=sys.stderr)
+                self.unreplayed.append((num, record))
+                continue
+            for name in record['nets']:
+                net = Network(name, lineNumber=num, code=name, source=path)
+                if self.addNetwork(net):
+                    acl.attachChild(net)
+
+    @staticmethod
+    def includePath(path, name):
+        """ Return the path of the shard 'name' which is
+        included by the shard 'path'.
+        """
+        return os.path.join(os.path.dirname(path), name)
+
+    @staticmethod
+    def readShards(paths, jobs=None):
+        """ Tokenize all shards, and the ones they include,
+        in parallel when there are more than one. Return
+        a dict, in which the key is the path of a shard,
+        the value is a tuple of the tokens and the errors.
+        The shards unchanged since they were cached in the
+        parseCache are not read again.
+        """
+        shards  = {}
+        pending = list(paths)
+        cache   = AclGroup.parseCache
+        while pending:
+            cached = {}
+            if cache is not None:
+                for path in pending:
+                    key, stamp = AclGroup.parseCacheKey(path)
+                    if key in cache and cache[key][0] == stamp:
+                        cached[path] = (path,) + cache[key][1:]
+            unread = [x for x in pending if x not in cached]
+            if len(unread) > 1 and jobs != 1:
+                with multiprocessing.Pool(jobs) as pool:
+                    fresh = pool.map(tokenizeAclDb, unread)
+            else:
+                fresh = [tokenizeAclDb(x) for x in unread]
+            for path, tokens, errors in fresh:
+                cached[path] = (path, tokens, errors)
+                if cache is not None:
+                    key, stamp = AclGroup.parseCacheKey(path)
+                    cache[key] = (stamp, tokens, errors)
+            results = [cached[x] for x in pending]
+            pending = []
+            for path, tokens, errors in results:
+                shards[path] = (tokens, errors)
+                for kind, num, data, cmnt in tokens:
+                    if kind == AclDbFormat.INCLUDE:
+                        included = AclGroup.includePath(path, data)
+                        if included not in shards and included not in pending:
+                            pending.append(included)
+        return shards
+
+    # the parts of the database readReachable looks for: an acl
+    # block, the same as the one of blockDb, an include directive
+    # and a lineage record
+    indexPattern  = re.compile(b'^acl\\s+"([^"]*)"[^\\n]*\\n.*?^};\\n'
+                               b'|^\\s*include\\s+"([^"]+)"\\s*;'
+                               b'|^#@lineage [^\\n]*\\n', re.M | re.S)
+    subAclPattern = re.compile(b'^\\s*"([^"]*)"', re.M)
+    aclLinePattern = re.compile(b'^[ \\t]*acl\\s', re.M)
+
+    @staticmethod
+    def readReachable(paths, names):
+        """ Index the acl blocks of the shards without parsing
+        them, then tokenize just the blocks of the acls in the
+        trees which contain the 'names' acls. An acl which has
+        been split is reached by its parts, found in the lineage
+        records, or by the prefix of the name for the ones not
+        recorded, see ViewGroup.resolveOneViewParts. Return a
+        tuple of the shards, in the form readShards returns,
+        and a list of the other acl trees, each is a tuple of
+        the name of the top acl and a list of (name, text) of
+        the acls in the order AclGroup.save writes them, the
+        text is a slice of the memory mapped shard.
+
+        If anything other than blank lines and comments is found
+        out of the blocks, or an acl block takes the start of the
+        next acl, a broken end of an acl for example, the index
+        can't be trusted, all the shards are tokenized by the
+        readShards method, which reports the broken lines, and
+        no tree is skipped.
+        """
+        blocks  = OrderedDict()     # name -> (path, start, end)
+        records = {}                # path -> lineage records
+        order   = []                # (path, kind, item) in file order
+        sources = {}
+        lineage = Lineage()
+        broken  = []                # paths not indexed in whole
+
+        def plain(data, start, end):
+            for line in data[start:end].split(b'\n'):
+                line = line.strip()
+                if line and not line.startswith(b'#'):
+                    return False
+            return True
+
+        def index(path):
+            if path in sources:
+                return
+            with open(path, 'rb') as f:
+                try:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                except ValueError:  # empty file
+                    data = b''
+            sources[path] = data
+            pos = 0
+            for m in AclGroup.indexPattern.finditer(data):
+                if m.start() > pos and not plain(data, pos, m.start()):
+                    broken.append(path)
+                pos = m.end()
+                if m.group(1) is not None:
+                    head = data.find(b'\n', m.start()) + 1
+                    if AclGroup.aclLinePattern.search(data, head, pos):
+                        broken.append(path)
+                    name  = m.group(1).decode()
+                    block = (path, m.start(), m.end())
+                    blocks.setdefault(name, block)
+                    order.append((path, AclDbFormat.ACLSTART, (name, block)))
+                elif m.group(2) is not None:
+                    name = m.group(2).decode()
+                    order.append((path, AclDbFormat.INCLUDE, name))
+                    index(AclGroup.includePath(path, name))
+                else:
+                    line = m.group(0)
+                    lineage.parseLine(line)
+                    order.append((path, AclDbFormat.COMMENT, line))
+
+            if not plain(data, pos, len(data)):
+                broken.append(path)
+
+        for path in paths:
+            index(path)
+        if broken:
+            return (AclGroup.readShards(paths), [])
+
+        # link the blocks both ways, a sub acl is reached by its
+        # parent, and the parent is reached by it, thus a tree
+        # is built in whole
+        links   = {}
+        subAcls = {}
+        for name, (path, start, end) in blocks.items():
+            for sub in AclGroup.subAclPattern.findall(sources[path], start, end):
+                sub = sub.decode()
+                links.setdefault(name, []).append(sub)
+                links.setdefault(sub, []).append(name)
+                subAcls.setdefault(name, []).append(sub)
+
+        pending = []
+        for name in names:
+            parts = lineage.parts(name)
+            if parts is None and name not in blocks:
+                flag  = name + '-'
+                parts = [x for x in blocks if x.startswith(flag)]
+            pending.append(name)
+            pending.extend(parts or [])
+        reached = set()
+        while pending:
+            name = pending.pop()
+            if name in reached or name not in blocks:
+                continue
+            reached.add(name)
+            pending.extend(links.get(name, []))
+
+        # tokens in the order of the files, the line numbers
+        # are counted up to the blocks tokenized
+        shards  = OrderedDict([(x, ([], [])) for x in sources])
+        texts   = {}
+        counted = dict([(x, (0, 1)) for x in sources])     # offset, number
+        for path, kind, item in order:
+            tokens, errors = shards[path]
+            if kind != AclDbFormat.ACLSTART:
+                tokens.append((kind, 0, item, None))
+                continue
+            name, (junk, start, end) = item
+            if blocks[name] != item[1]:
+                continue    # a duplicate, the first one is taken
+            elif name not in reached:
+                texts[name] = memoryview(sources[path])[start:end]
+            else:
+                data = sources[path]
+                pos, num = counted[path]
+                num += data[pos:start].count(b'\n')
+                lines = [x + b'\n' for x in data[start:end - 1].split(b'\n')]
+                counted[path] = (end, num + len(lines))
+                for token in scanAclLines(lines, num):
+                    if token[0] == AclDbFormat.OTHER:
+                        errors.append(token[1:3])
+                    else:
+                        tokens.append(token)
+
+        # the skipped trees, a sub acl comes before its parent,
+        # in the order the save method writes them
+        def walk(name, queue):
+            if name in texts and name not in taken:
+                taken.add(name)
+                queue.append((name, texts[name]))
+                for sub in subAcls.get(name, []):
+                    walk(sub, queue)
+
+        taken   = set()
+        skipped = []
+        subs    = set([x for name in texts for x in subAcls.get(name, [])])
+        for pick in ((lambda x: x not in subs), (lambda x: x not in taken)):
+            for name in [x for x in texts if pick(x)]:  # tops first
+                queue = []
+                walk(name, queue)
+                if queue:
+                    skipped.append((name, queue[::-1]))
+        return (shards, skipped)
+
+    @staticmethod
+    def parseCacheKey(path):
+        """ Return the key of the shard in the parseCache, and
+        the stamp that tells if the cached one is up to date.
+        """
+        st = os.stat(path)
+        return (os.path.realpath(path), (st.st_size, st.st_mtime_ns))
+
     def checkSyntax(self, dbFile):
         """ Check if all lines in dbFile conforms to the rules.
         Even the dbFile have no syntax error from DNS server's
@@ -377,15 +1148,11 @@ class AclGroup(TreeGroup):
         don't allow this, every network shall have a subnet
         suffix, like 119.120.121.0/24.
         """
-        lines = open(dbFile, 'rb').readlines()
-        fmt   = AclDbFormat()
-        stat  = True
-        for num, line in enumerate(lines, 1):
-            if fmt.match(line) == AclDbFormat.OTHER:
-                line = line.decode().rstrip('\n')
-                print('error: %s:%s' % (num, line), file=sys.stderr)
-                stat = False
-        return stat
+        path, tokens, errors = tokenizeAclDb(dbFile)
+        for num, line in errors:
+            line = line.decode().rstrip('\n')
+            print('error: %s:%s' % (num, line), file=sys.stderr)
+        return not errors
 
     def addNetwork(self, net):
         """ Add the network to the group
@@ -396,12 +1163,74 @@ class AclGroup(TreeGroup):
             old_net  = e.args[0]
             old_info = '%s:%s' % (old_net.lineNumber, old_net.code)
             new_info = '%s:%s' % (net.lineNumber, net.code)
+            if old_net.source:
+                old_info = '%s:%s' % (old_net.source, old_info)
+            if net.source:
+                new_info = '%s:%s' % (net.source, new_info)
             msg      = 'duplicate net: %s <%s, %s>' % (net.name, old_info, new_info)
             print(msg, file=sys.stderr)
             return False
         else:
             return True
 
+    def importNetworks(self, acl, rows, source=None):
+        """ Add the networks of the rows to the acl, a row is a
+        tuple of (firstInt, lastInt, code, comment, lineNumber).
+        Before any Network is created, the rows and the existing
+        networks of the acl are sorted by (first address, -last
+        address) and swept once, a network that is covered by
+        the one before it, being a duplicate or a redundant one,
+        is dropped, then the rest are created and attached to the
+        acl in one step. A network that belongs to another acl
+        is reported as a duplicate. Return the number of networks
+        added.
+        """
+        items = [(x.firstInt, -x.lastInt, 0, None) for x in acl.networks()]
+        items.extend([(x[0], -x[1], 1, x) for x in rows])
+        items.sort(key=(lambda x: x[:3]))
+        coverLast = -1
+        nets      = []
+        for firstInt, negLast, isNew, row in items:
+            if -negLast <= coverLast:   # duplicate or redundant
+                continue
+            coverLast = -negLast
+            if not isNew:
+                continue
+            firstInt, lastInt, code, comment, lineNumber = row
+            name = Network.formatNetwork(firstInt, lastInt)
+            net  = Network(name, code=code, comment=comment,
+                           lineNumber=lineNumber, source=source)
+            if name in self.data:
+                self.addNetwork(net)    # report the duplicate
+                continue
+            self.data[name] = net
+            nets.append(net)
+        acl.attachChildren(nets)
+        acl.removeRedundant()
+        return len(nets)
+
+    def aggregateAcl(self, acl, taken=None):
+        """ Merge the sibling networks of the acl, keep the
+        group data in step with the acl, return the number
+        of saved entries. A name in 'taken', a set which
+        defaults to the names of the group data, is never
+        used for a merged network, the set is kept in step
+        with the acl too.
+        """
+        if taken is None:
+            taken = set(self.data)
+        removed, added = acl.aggregate(taken=taken)
+        for net in removed:
+            if self.data.get(net.name) is net:
+                self.data.pop(net.name)
+                taken.discard(net.name)
+        for net in added:
+            self.data[net.name] = net
+            taken.add(net.name)
+        saved = len(removed) - len(added)
+        self.savedCount += saved
+        return saved
+
     def parentsOfNets(self, nets):
         """ Return a unique set of parents of networks
         """
@@ -412,40 +1241,62 @@ class AclGroup(TreeGroup):
 
     def addAcl(self, begin_acl, validator=None, args=None):
         """ Add the acl to the group. Duplicate name of acl
-        will be ignored; for a NotCoexistsException exception,
-        do a binary split to the parent acls of the networks
-        which cause the problem, and try again to add the new
-        set of ACLs. For optimazation, we split out the group
-        of networks which creates less new Acls involves less
-        operations.
-        """
-        acls = {begin_acl.name: begin_acl}
-        while acls:
-            acl_name = list(acls.keys())[0]
-            acl_obj  = acls.pop(acl_name)
-            try:
+        will be ignored. The validator returns a Conflict if
+        the acl can not be added, in which case do a binary
+        split to the parent acls of the networks which cause
+        the problem, the new set of ACLs are pushed to the
+        work queue and added in turn. For optimazation, we
+        split out the group of networks which creates less
+        new Acls involves less operations.
+        """
+        queue = self.queue
+        queue.push(begin_acl)
+        with Tracer.begin('addAcl', 'acl', acl=begin_acl.name):
+            for acl_obj in queue:
                 if validator:
-                    self.addNode(acl_obj, validator, args)
-                else:
+                    with Tracer.begin('checkAcl', 'acl', acl=acl_obj.name) as check:
+                        conflict = validator(acl_obj, *args)
+                        if check:
+                            check.args['nets'] = len(acl_obj.networks())
+                            check.args['conflict'] = conflict and conflict.other.name
+                    if conflict is None:
+                        self.data[acl_obj.name] = acl_obj
+                    else:   # call the handler to split
+                        self.coexistHandler(conflict=conflict, new_acl=acl_obj,
+                                            queue=queue)
+                    continue
+                try:
                     self.addNode(acl_obj)   # default validator
-            except NodeExistsException as e:
-                obj  = e.args[0]
-                offended_info = '%s:%s' % (obj.lineNumber, obj_name)
-                print('duplicate acl: %s, %s:%s' %
-                        (offended_info, acl_obj.lineNumber, acl_name), file=sys.stderr)
-            except NotCoexistsException as e:   # call the handler to split
-                self.coexistExceptionHandler(e=e, new_acl=acl_obj, acls=acls)
+                except NodeExistsException as e:
+                    obj  = e.args[0]
+                    offended_info = '%s:%s' % (obj.lineNumber, obj.name)
+                    print('duplicate acl: %s, %s:%s' %
+                            (offended_info, acl_obj.lineNumber, acl_obj.name),
+                            file=sys.stderr)
+
+    def coexistHandler(self, *junk, conflict, new_acl, queue):
+        """ Handler for coexist conflict, to split the acl
+        with the strategy named by self.strategy.
+        """
+        handler = getattr(self, self.strategy + 'Strategy')
+        with Tracer.begin('resolve', 'acl', acl=new_acl.name,
+                          other=conflict.other.name, strategy=self.strategy):
+            handler(conflict=conflict, new_acl=new_acl, queue=queue)
 
-    def coexistExceptionHandler(self, *junk, e, new_acl, acls):
-        """ Handler for coexist exception, to split the acl
+    def greedyStrategy(self, *junk, conflict, new_acl, queue):
+        """ Resolve the single conflict carried by the descriptor,
+        split whichever of the two acls takes less efforts.
         """
         # pick the least acls/efforts nets
-        less_rela, greater_rela = e.args[0]
-        l_n_nets = set([x[0] for x in less_rela])   # nets of new acl in LESS group
-        l_o_nets = set([x[1] for x in less_rela])   # nets of old acl in LESS group
-        g_n_nets = set([x[0] for x in greater_rela])
-        g_o_nets = set([x[1] for x in greater_rela])
-        old_acl  = e.args[1]
+        # unique nets in the order they appear, not sets, the
+        # order of the split networks shall not vary from run to run
+        less_rela, greater_rela = conflict.data
+        swap     = (lambda rela: [(y, x) for x, y in rela])
+        l_n_nets = self.uniqFirst(less_rela)            # nets of new acl in LESS group
+        l_o_nets = self.uniqFirst(swap(less_rela))      # nets of old acl in LESS group
+        g_n_nets = self.uniqFirst(greater_rela)
+        g_o_nets = self.uniqFirst(swap(greater_rela))
+        old_acl  = conflict.other
         count_new = len(self.parentsOfNets(l_n_nets))   # parents of new acl
         count_old = len(self.parentsOfNets(l_o_nets))   # parents of old acl
         if count_new < count_old:
@@ -456,40 +1307,441 @@ class AclGroup(TreeGroup):
         nets = g[1] if len(g[1]) < len(g[2]) else g[2]
 
         if acl == new_acl: # split the new
-            new_acls = Acl.splitTree(nets)
+            new_acls = self.splitAcl(nets)
             for new_acl in new_acls:
-                acls[new_acl.name] = new_acl
+                queue.push(new_acl)
         else:   # split the old
             old_acl_name = acl.name # get name befor split
-            old_acl0, old_acl1 = Acl.splitTree(nets)
+            old_acl0, old_acl1 = self.splitAcl(nets)
             self.data.pop(old_acl_name)
             self.data[old_acl0.name] = old_acl0
             self.data[old_acl1.name] = old_acl1
-            acls[new_acl.name] = new_acl
+            queue.push(new_acl)
+
+    def minsplitStrategy(self, *junk, conflict, new_acl, queue):
+        """ Resolve all conflicts of the new acl together. For
+        every conflicting old acl, the LESS networks and the
+        GREATER networks of the new acl shall end up in different
+        parts, which is a two-coloring of the involved networks.
+        When such a coloring exists, one split solves all the
+        conflicts, of all the colorings the one that splits the
+        least parent acls and networks is picked, exhaustively
+        when there are not more than self.exactLimit independent
+        choices, otherwise choice by choice.
+
+        When no coloring exists, split out the smallest set of
+        networks that leaves the rest free of conflicts, the
+        split part will be checked again. A single conflict,
+        or one that nothing can be picked for, is left to the
+        greedy strategy, which may split the old acl instead.
+        """
+        conflicts = []
+        for old_acl in [x for x in self.data.values() if isinstance(x, Acl)]:
+            stat, relations = self.coexist(new_acl, old_acl)
+            if not stat:
+                less_rela, greater_rela = relations
+                l_nets = self.uniqFirst(less_rela)
+                g_nets = self.uniqFirst(greater_rela)
+                conflicts.append((l_nets, g_nets))
+
+        if len(conflicts) == 1:     # nothing to consider together
+            self.greedyStrategy(conflict=conflict, new_acl=new_acl, queue=queue)
+            return
+        nets = self.colorSplit(conflicts)
+        if nets is None:
+            nets = self.hittingSplit(conflicts, len(new_acl.networks()))
+        if not nets:
+            self.greedyStrategy(conflict=conflict, new_acl=new_acl, queue=queue)
+            return
+        if self.verbose >= 1:
+            print('splitting acl %s: %s conflicts, %s networks' %
+                    (new_acl.name, len(conflicts), len(nets)))
+        for part in self.splitAcl(nets):
+            queue.push(part)
+
+    def splitAcl(self, nets):
+        """ Split the nets out of their acls, see Acl.splitTree,
+        the names of the nets are recorded in self.splits if it
+        is a list, thus the same split can be made again.
+        """
+        if self.splits is not None:
+            self.splits.append([x.name for x in nets])
+        return Acl.splitTree(nets, self.lineage)
+
+    def splitCost(self, nets):
+        """ The efforts of splitting the nets out, the number
+        of parent acls to split first, then the networks.
+        """
+        return (len(self.parentsOfNets(nets)), len(nets))
+
+    def colorSplit(self, conflicts):
+        """ Two-color the networks of the conflicts, return the
+        networks of one color, or None if no coloring exists.
+        """
+        # union-find with parity, a conflict is represented
+        # by ('c', its index), a network by itself
+        owner  = {}
+        parity = {}
+        def find(x):
+            if owner.setdefault(x, x) == x:
+                parity.setdefault(x, 0)
+                return x
+            root = find(owner[x])
+            parity[x] ^= parity[owner[x]]
+            owner[x]   = root
+            return root
+
+        for idx, (l_nets, g_nets) in enumerate(conflicts):
+            key = ('c', idx)
+            for nets, side in ((l_nets, 0), (g_nets, 1)):
+                for net in nets:
+                    r1, r2 = find(key), find(net)
+                    p = parity[key] ^ parity[net] ^ side
+                    if r1 == r2:
+                        if p:
+                            return None     # odd cycle
+                    else:
+                        owner[r2]  = r1
+                        parity[r2] = p
+
+        groups = {}
+        for x in owner:
+            if not isinstance(x, tuple):
+                root = find(x)
+                groups.setdefault(root, []).append((x, parity[x]))
+        groups = list(groups.values())
+        def pick(flips):
+            return [net for flip, members in zip(flips, groups)
+                        for net, p in members if p ^ flip]
+
+        if len(groups) <= self.exactLimit:
+            best = None
+            for mask in range(2 ** len(groups)):
+                flips = [mask >> i & 1 for i in range(len(groups))]
+                nets  = pick(flips)
+                if best is None or self.splitCost(nets) < self.splitCost(best):
+                    best = nets
+            return best
+        else:
+            flips = []
+            for members in groups:
+                ones = len([x for x in members if x[1]])
+                flips.append(1 if ones > len(members) - ones else 0)
+            return pick(flips)
+
+    def hittingSplit(self, conflicts, allCount):
+        """ Return the least networks which include either the
+        LESS ones or the GREATER ones of every conflict, but
+        not all the 'allCount' networks. None if no such set.
+        """
+        best = None
+        if len(conflicts) <= self.exactLimit:
+            for mask in range(2 ** len(conflicts)):
+                nets = []
+                for idx, (l_nets, g_nets) in enumerate(conflicts):
+                    side = g_nets if mask >> idx & 1 else l_nets
+                    nets.extend(x for x in side if x not in nets)
+                if len(nets) == allCount:
+                    continue
+                if best is None or self.splitCost(nets) < self.splitCost(best):
+                    best = nets
+        else:
+            nets = []
+            conflicts = sorted(conflicts, key=(lambda x: -min(len(x[0]), len(x[1]))))
+            for l_nets, g_nets in conflicts:
+                l_new = [x for x in l_nets if x not in nets]
+                g_new = [x for x in g_nets if x not in nets]
+                if not l_new or not g_new:     # already solved
+                    continue
+                nets.extend(l_new if len(l_new) <= len(g_new) else g_new)
+            if len(nets) != allCount:
+                best = nets
+        return best
+
+    @staticmethod
+    def uniqFirst(relations):
+        """ Return the unique first elements of the relation
+        pairs, in the order they appear.
+        """
+        res  = []
+        seen = set()
+        for x, y in relations:
+            if x not in seen:
+                seen.add(x)
+                res.append(x)
+        return res
 
     def removeConflicts(self):
         """ Re-add all ACLs again to deal with the coexistent
         problem. Pass an acl validator for checking, and let
         self.addAcl do the work.
+
+        An acl only conflicts with the acls of its component,
+        see the components method, and with the parts of them,
+        so the components are resolved one by one, each in a
+        dict of its own. Every acl that lands in self.data is
+        stamped with the index of the top acl being added at
+        the time, thus self.data is in the same order as if
+        all acls were added to it one by one.
+
+        If self.resultCache is set, the splits made for every
+        component of more than one acl are cached under the
+        hash of the component's content, an unchanged component
+        is split the same way again without any check.
         """
-        acls = [x for x in self.data.values()
-                if isinstance(x, Acl) and not x.parent]
+        tops   = [x for x in self.data.values()
+                    if isinstance(x, Acl) and not x.parent]
+        order  = dict([(acl, idx) for idx, acl in enumerate(tops)])
+        cache  = self.resultCache
+        placed = []     # (index of the top acl, sequence, acl)
+        for comp in self.components(tops):
+            result = None
+            if len(comp) > 1 and cache is not None:
+                key    = self.componentKey(comp)
+                result = cache.get(key)
+                if result is not None:
+                    landed = self.replaySplits(comp, result)
+                    if landed is None:  # not of this component
+                        cache.drop(key)
+                        result = None
+            if result is None:
+                result, landed = self.resolveComponent(comp)
+                if len(comp) > 1 and cache is not None:
+                    cache.put(key, result)
+            for seq, (idx, acl) in enumerate(landed):
+                placed.append((order[comp[idx]], seq, acl))
+        placed.sort(key=(lambda x: x[:2]))
         self.data = {}
-        for acl in acls:
-            self.addAcl(acl, self.aclValidator, (self.data,))
+        for idx, seq, acl in placed:
+            self.data[acl.name] = acl
+
+    def components(self, tops):
+        """ Group the 'tops' acls into components, two acls
+        of which any network covers the other's belong to
+        the same component. Return a list of components, a
+        component is a list of acls in the order of 'tops',
+        the components are in the order of their first acl.
+        """
+        owner = {}
+        def find(x):
+            while owner.get(x, x) is not x:
+                owner[x] = owner.get(owner[x], owner[x])
+                x = owner[x]
+            return x
+
+        junk, relations = self.findRelations()
+        for acl1, acl2 in relations:
+            r1, r2 = find(acl1), find(acl2)
+            if r1 is not r2:
+                owner[r2] = r1
+        groups = {}
+        for acl in tops:
+            groups.setdefault(find(acl), []).append(acl)
+        return list(groups.values())
+
+    def componentKey(self, comp):
+        """ Return the hash of the content of the component,
+        the trees of its acls in order, along with the strategy
+        which resolves the conflicts.
+        """
+        pieces = [('%s %s\n' % (self.strategy, self.exactLimit)).encode()]
+        def walk(node):
+            if isinstance(node, Acl):
+                pieces.append(('{%s\n' % node.name).encode())
+                for child in node.childNodes:
+                    walk(child)
+                pieces.append(b'}\n')
+            else:
+                pieces.append(('%s\n' % node.name).encode())
+        for acl in comp:
+            walk(acl)
+        return BlockDb.digest(pieces)
+
+    def resolveComponent(self, comp):
+        """ Add the acls of the component one by one, splitting
+        them where they conflict. Return the result to cache,
+        a dict of the splits made and the names of the acls
+        landed, along with the index of the top acl of the
+        component being added when every acl landed, and a
+        list of the (index, acl) in the order they landed.
+        """
+        data = self.data = StampedDict()
+        self.splits = []
+        for idx, acl in enumerate(comp):
+            data.stamp = idx    # the acls set in data from now on
+            self.addAcl(acl, self.aclValidator, (data,))
+        splits, self.splits = self.splits, None
+        landed = [data.stamps[x] for x in data]
+        result = {'splits': splits,
+                  'landed': [[x[1].name, x[0]] for x in landed]}
+        return (result, landed)
+
+    def replaySplits(self, comp, result):
+        """ Make the splits of the cached result to a copy of the
+        acls of the component. Return a list of (index, acl) of
+        the landed acls of the copy, see resolveComponent, or None
+        if the result does not fit the component, a broken or a
+        stale entry, which is taken as a miss, nothing is changed
+        in that case. The splits are recorded in self.lineage only
+        when they all fit.
+        """
+        comp = pickle.loads(pickle.dumps(comp, pickle.HIGHEST_PROTOCOL))
+        nets = {}
+        for acl in comp:
+            for net in acl.leaves():
+                nets[net.name] = net
+        lineage = Lineage()
+        try:
+            for split in result['splits']:
+                if [x for x in split if x not in nets]:
+                    return None
+                Acl.splitTree([nets[x] for x in split], lineage)
+            landed = [(idx, name) for name, idx in result['landed']]
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return None
+        acls = {}
+        for net in nets.values():
+            node = net
+            while node.parent:
+                node = node.parent
+            acls[node.name] = node
+        if sorted([x[1] for x in landed]) != sorted(acls):
+            return None
+        self.lineage.replay(lineage.events)
+        return [(idx, acls[name]) for idx, name in landed]
+
+    def findRelations(self):
+        """ Find the relations of all pairs of top acls, without
+        changing anything. The networks of all top acls are
+        sorted once by address, two networks are either disjoint
+        or one covers the other, so in a single sweep, the
+        networks that cover the current one are exactly those
+        left on a stack. Return the top acls in the order of
+        definition, and a dict of (acl1, acl2) to
+
+            (less_rela, greater_rela)
+
+        of the same form as the coexist method returns, acl1
+        is the one defined later.
+        """
+        tops  = [x for x in self.data.values()
+                    if isinstance(x, Acl) and x.parent is None]
+        order = {acl: idx for idx, acl in enumerate(tops)}
+        items = []
+        for acl in tops:
+            for net in acl.networks():
+                items.append((net, acl))
+        items.sort(key=(lambda x: (x[0].firstInt, -x[0].lastInt)))
+
+        relations = {}
+        stack     = []      # networks that cover the current one
+        for net, acl in items:
+            while stack and stack[-1][0].lastInt < net.firstInt:
+                stack.pop()
+            for outer, outer_acl in stack:
+                if outer_acl is acl or net.compare(outer) == Network.EQUAL:
+                    continue
+                # net is LESS than outer
+                if order[acl] > order[outer_acl]:
+                    rela = relations.setdefault((acl, outer_acl), ([], []))
+                    rela[0].append((net, outer))
+                else:
+                    rela = relations.setdefault((outer_acl, acl), ([], []))
+                    rela[1].append((outer, net))
+            stack.append((net, acl))
+        return (tops, relations)
+
+    def findConflicts(self):
+        """ Find all pairs of top acls that can not coexist,
+        without changing anything, see findRelations. Return
+        a list of tuples
+
+            (acl1, acl2, less_rela, greater_rela)
+
+        acl1 is the one defined later.
+        """
+        tops, relations = self.findRelations()
+        order = {acl: idx for idx, acl in enumerate(tops)}
+        res   = []
+        for (acl1, acl2), (l_rela, g_rela) in relations.items():
+            if len(l_rela) and len(g_rela):
+                res.append((acl1, acl2, l_rela, g_rela))
+        res.sort(key=(lambda x: (order[x[0]], order[x[1]])))
+        return res
+
+    # a block of the acl database is an acl
+    blockDb = BlockDb(b'^acl\\s+"([^"]*)"[^\\n]*\\n.*?^};\\n')
 
     @staticmethod
-    def save(heads, dbFile):
+    def save(heads, dbFile, lineage=None, byShard=False,
+             compareTo=None, keepLayout=False, skipped=(), includes=None):
         """ Save the group data to a database file.
         for nested ACL, output the inner one, then
         the outer one. The provided 'heads' are the
-        top ACLs in the AclGroup.
+        top ACLs in the AclGroup. The 'lineage' is
+        written on top of the file if provided.
+
+        If 'byShard' is True, the dbFile is a directory,
+        every head is saved to a file in it, at the path of
+        the shard which the head comes from, relative to the
+        directory of all shards, along with the lineage of
+        the heads in that shard. The 'includes' is a dict of
+        the path of every shard to the names it includes then,
+        as the one of the load method, otherwise a list of the
+        names the dbFile includes, the include directives are
+        written after the lineage.
+
+        The heads are saved in the order of name, every
+        acl is compared with the one in the compareTo file
+        or the existing dbFile, a report of the changed
+        acls is returned, see BlockDb.save for the details,
+        and the 'keepLayout' argument.
+
+        The 'skipped' is a list of the acl trees not loaded,
+        see the load method, a tree is a tuple of the name of
+        the top acl and a list of (name, text) of its acls,
+        they are saved as they are, in the order of the name
+        along with the heads.
         """
         # remove the 'ANY' acl, sort the heads,
         # the 'ANY' acl may be added by a view.
         heads = [h for h in heads if h.name != 'ANY']
         heads = sorted(heads, key=(lambda x: x.name))
 
+        if byShard:
+            assert not skipped, "skipped acls have no shard"
+            if not os.path.isdir(dbFile):
+                os.makedirs(dbFile)
+            if includes is None:
+                includes = {}
+            sources = [x.source for x in heads if x.source] + list(includes)
+            root    = (os.path.commonpath([os.path.dirname(x) for x in sources])
+                            if sources else '')
+            shards  = dict([(x, []) for x in includes])
+            for head in heads:
+                shards.setdefault(head.source or os.path.join(root, 'acl.conf'),
+                                  []).append(head)
+            reports = []
+            for source, shardHeads in sorted(shards.items()):
+                if not shardHeads and not includes.get(source):
+                    continue
+                shardLineage = None
+                if lineage is not None:
+                    names = [x.name for x in shardHeads]
+                    shardLineage = lineage.subset(names)
+                name = os.path.relpath(source, root) if root else source
+                path = os.path.join(dbFile, name)
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                oldPath = None
+                if compareTo is not None:
+                    oldPath = os.path.join(compareTo, name)
+                reports.append(AclGroup.save(shardHeads, path, shardLineage,
+                                             compareTo=oldPath,
+                                             keepLayout=keepLayout,
+                                             includes=includes.get(source)))
+            return BlockDb.mergeReports(reports)
+
         def format_node(node):
             """ Format the node's data, return a bytes
             """
@@ -529,21 +1781,32 @@ class AclGroup(TreeGroup):
             in a reverse order
             """
             text   = format_node(acl)
-            queue.append(text)
+            queue.append((acl.name, text))
             subacls = [x for x in acl.childNodes if isinstance(x, Acl)]
             for subacl in subacls:
                 format_acl(subacl, queue)
 
-        ofile = open(dbFile, 'wb')
+        header = lineage.format() if lineage is not None else b''
+        for name in includes or ():
+            header += ('include "%s";\n' % name).encode()
+        groups = list(skipped)
         for head in heads:
             queue = []
             format_acl(head, queue)
-            lines = queue[::-1]
-            ofile.writelines(lines)
+            groups.append((head.name, queue[::-1]))
+        groups.sort(key=(lambda x: x[0]))
+        blocks = []
+        for name, queue in groups:
+            blocks.extend(queue)
+        return AclGroup.blockDb.save(dbFile, header, blocks,
+                                     compareTo=compareTo,
+                                     keepLayout=keepLayout)
 
     def aclValidator(self, new_acl, group):
         """ Check if the introduction of the
-        new_acl causes a coexistent probjem.
+        new_acl causes a coexistent probjem, return
+        a Conflict with the first acl it conflicts
+        with, or None if there is no problem.
         """
         acl_group = [x for x in group.values() if isinstance(x, Acl)]
         for old_acl in acl_group:
@@ -551,8 +1814,8 @@ class AclGroup(TreeGroup):
                 print('comparing acl: %s <---> %s' % (new_acl.name, old_acl.name))
             stat, relations = self.coexist(new_acl, old_acl)
             if not stat:
-                raise NotCoexistsException(relations, old_acl)
-        return True
+                return Conflict(relations, old_acl)
+        return None
 
     def coexist(self, acl1, acl2):
         """ Check if acl1 can coexist with acl2 in the same group.
@@ -575,3 +1838,200 @@ class AclGroup(TreeGroup):
             return (False, [l_rela, g_rela])
         else:
             return (True, None)
+
+
+class AclStreamCheck:
+    """ Check an acl database without building the trees, for
+    databases too large to load. The networks are streamed to
+    an external sort as (firstInt, -lastInt, shard, lineNumber,
+    acl) records, only the acls are kept in memory. In the order
+    of (first address, -last address), the networks that cover
+    the current one are exactly those left on a stack, thus a
+    sequential pass over the sorted records finds:
+
+        duplicate networks, the same network defined twice
+        redundant networks, covered by another one of the same
+            top acl, they take no part in the coexist check
+        coexist problems, top acls one of whose networks is
+            LESS than the other's and another is GREATER
+    """
+    def __init__(self, dbFile, memLimit=256 * 1024 * 1024):
+        self.dbFile   = dbFile
+        self.memLimit = memLimit
+        self.names    = []      # acl names in the order of definition
+        self.lines    = []      # line numbers of the acls
+        self.sources  = []      # shard paths
+        self.top      = []      # acl index -> index of its top acl
+        self.records  = None
+        self.stat     = True
+
+    def scan(self):
+        """ Stream all shards into the external sort, link the
+        acls, report syntax errors and duplicate acls.
+        """
+        self.records = ExternalSort(self.memLimit)
+        shardPaths   = AclGroup.shardPaths(self.dbFile)
+        multi        = len(shardPaths) > 1
+        defined      = {}
+        subacls      = []   # (acl index, name of the sub acl)
+        done         = set()
+
+        def read(path):
+            if path in done:
+                return
+            done.add(path)
+            shard = len(self.sources)
+            self.sources.append(path)
+            where = '%s:' % path if multi else ''
+            acl   = None
+            for kind, num, data, cmnt in scanAclDb(path):
+                if kind == AclDbFormat.OTHER:
+                    line = data.decode().rstrip('\n')
+                    print('error: %s%s:%s' % (where, num, line), file=sys.stderr)
+                    self.stat = False
+                elif kind == AclDbFormat.ACLSTART:
+                    acl = len(self.names)
+                    self.names.append(data)
+                    self.lines.append(num)
+                    if data in defined:
+                        print('duplicate acl: %s, %s%s:%s' %
+                                (self.lines[defined[data]], where, num, data),
+                                file=sys.stderr)
+                        self.stat = False
+                        acl = None  # ignored, as the loader does
+                    else:
+                        defined[data] = acl
+                elif kind == AclDbFormat.NETWORK and acl is not None:
+                    net = parseCidr(data)
+                    if net is None:
+                        print('error: %s%s:%s' % (where, num, data), file=sys.stderr)
+                        self.stat = False
+                    else:
+                        self.records.add((net[0], -net[1], shard, num, acl))
+                elif kind == AclDbFormat.SUBACL and acl is not None:
+                    subacls.append((acl, data))
+                elif kind == AclDbFormat.INCLUDE:
+                    read(AclGroup.includePath(path, data))
+
+        for path in shardPaths:
+            read(path)
+
+        parent = {}
+        for acl, name in subacls:
+            sub = defined.get(name)
+            if sub is not None and sub not in parent:
+                parent[sub] = acl
+        for acl in range(len(self.names)):
+            top  = acl
+            seen = set()
+            while top in parent and top not in seen:
+                seen.add(top)
+                top = parent[top]
+            self.top.append(top)
+
+    def netInfo(self, record):
+        """ Return a text of the network of the record, and
+        where it is defined.
+        """
+        firstInt, negLast, shard, num, acl = record
+        name  = Network.formatNetwork(firstInt, -negLast)
+        where = '%s:%s' % (num, self.names[acl])
+        if len(self.sources) > 1:
+            where = '%s:%s' % (self.sources[shard], where)
+        return (name, where)
+
+    def sweep(self):
+        """ Yield the events in the sorted records, an event
+        is a tuple of (kind, record, other record), the kind
+        is 'duplicate', 'redundant', or 'less' which tells the
+        network of the record is LESS than the other one.
+        """
+        stack    = []
+        previous = None
+        for record in self.records:
+            firstInt, lastInt = record[0], -record[1]
+            if previous is not None and previous[:2] == record[:2]:
+                yield ('duplicate', record, previous)
+                continue
+            previous = record
+            while stack and -stack[-1][1] < firstInt:
+                stack.pop()
+            top   = self.top[record[4]]
+            cover = [x for x in stack if self.top[x[4]] == top]
+            if cover:
+                yield ('redundant', record, cover[-1])
+                continue
+            for other in stack:
+                yield ('less', record, other)
+            stack.append(record)
+
+    def check(self, verbose=0):
+        """ Scan the database and report all problems, the
+        network pairs of the coexist problems are reported
+        in verbose mode, they are found in a second pass.
+        Return True if no problem found.
+        """
+        self.scan()
+        flags = {}      # (acl1, acl2) -> 1 for LESS, 2 for GREATER
+        try:
+            for kind, record, other in self.sweep():
+                if kind == 'less':
+                    acl1, acl2 = self.top[record[4]], self.top[other[4]]
+                    if acl1 > acl2:     # acl1 is the later one
+                        key, flag = (acl1, acl2), 1
+                    else:
+                        key, flag = (acl2, acl1), 2
+                    flags[key] = flags.get(key, 0) | flag
+                else:
+                    self.stat = False
+                    new = self.netInfo(record)
+                    old = self.netInfo(other)
+                    if kind == 'duplicate':
+                        print('duplicate net: %s <%s, %s>' %
+                                (new[0], old[1], new[1]), file=sys.stderr)
+                    else:
+                        print('redundant net: %s <%s>, covered by %s <%s>' %
+                                (new[0], new[1], old[0], old[1]), file=sys.stderr)
+
+            conflicts = sorted([x for x, v in flags.items() if v == 3])
+            if conflicts and verbose >= 1:
+                self.reportRelations(conflicts)
+            else:
+                for acl1, acl2 in conflicts:
+                    self.reportConflict(acl1, acl2)
+        finally:
+            self.records.close()
+        return self.stat and not conflicts
+
+    def reportConflict(self, acl1, acl2):
+        print("coexist problem: %s:%s <---> %s:%s" %
+                (self.lines[acl1], self.names[acl1],
+                 self.lines[acl2], self.names[acl2]),
+                file=sys.stderr)
+
+    def reportRelations(self, conflicts):
+        """ Collect the network pairs of the conflicts in a
+        second pass, and report them.
+        """
+        relations = dict([(x, ([], [])) for x in conflicts])
+        for kind, record, other in self.sweep():
+            if kind != 'less':
+                continue
+            acl1, acl2 = self.top[record[4]], self.top[other[4]]
+            if (acl1, acl2) in relations:
+                relations[(acl1, acl2)][0].append((record, other))
+            elif (acl2, acl1) in relations:
+                relations[(acl2, acl1)][1].append((other, record))
+        for acl1, acl2 in conflicts:
+            self.reportConflict(acl1, acl2)
+            name1, name2 = self.names[acl1], self.names[acl2]
+            leftLen    = max(len(name1), 17)
+            headFormat = "%%%ss       %%s" % leftLen
+            netFormat  = "%%%ss  %%s  %%s" % leftLen
+            print(headFormat % (name1, name2), file=sys.stderr)
+            less, greater = relations[(acl1, acl2)]
+            for sign, pairs in (('<  ', less), ('  >', greater)):
+                for record1, record2 in pairs:
+                    net1 = self.netInfo(record1)[0]
+                    net2 = self.netInfo(record2)[0]
+                    print(netFormat % (net1, sign, net2), file=sys.stderr)
@@ -5,16 +5,27 @@ Location: Shenzhen
 Desc: Library for tree related works
 
 """
+from collections import deque, OrderedDict
+import hashlib
+import heapq
+import fcntl
+import json
+import mmap
+import os
+import re
+import tempfile
+import time
+import types
+
 class NotBranchException(Exception): pass
 class NodeExistsException(Exception): pass
 class NodeNotExistsException(Exception): pass
 class NodeTakenException(Exception): pass
 class NotChildException(Exception): pass
 class InvalidNetworkException(Exception): pass
-class NotCoexistsException(Exception): pass
 class InvalidViewConfigException(Exception): pass
 class ViewExistsException(Exception): pass
-class ViewOrderException(Exception): pass
+class InvalidJournalException(Exception): pass
 
 class Node:
     """ A tree element
@@ -22,6 +33,16 @@ class Node:
     parent   = None
     isBranch = False
 
+    # answer parents, topParent and covers with a TreeIndex,
+    # which is built for a tree when it's first asked, and
+    # again only after the tree has changed
+    useIndex  = False
+    treeIndex = None
+
+    # number of changes made to the subtree of the node, for
+    # the caches of what is computed from the subtree
+    version   = 0
+
     def __init__(self, name):
         self.name = name
 
@@ -41,10 +62,42 @@ class Node:
             self.parent.clearChildNodes()
         newParent.attachChild(self)
 
+    def touch(self):
+        """ Invalidate the index of the tree the node is in,
+        and count a change of the node and all its parents,
+        called whenever the tree changes.
+        """
+        if self.treeIndex is not None:
+            self.treeIndex.valid = False
+        node = self
+        while node is not None:
+            node.version += 1
+            node = node.parent
+
+    def index(self):
+        """ Return the valid index of the tree the node is
+        in, build it if the tree has changed. Return None
+        if the index is not used, or the node can not be
+        reached from the top of the tree.
+        """
+        if not Node.useIndex:
+            return None
+        if self.treeIndex is None or not self.treeIndex.valid:
+            top = self
+            while top.parent:
+                top = top.parent
+            if top.treeIndex is None or not top.treeIndex.valid:
+                TreeIndex(top)
+        if self.treeIndex is not None and self.treeIndex.valid:
+            return self.treeIndex
+        return None
+
     def parents(self):
         """ Return a list of parents from the node up,
         nearest first.
         """
+        if self.index() is not None:
+            return list(self.ancestors)
         res = []
         parent = self.parent
         while parent:
@@ -56,11 +109,43 @@ class Node:
         """ Return the top parent of a node,
         top parent is the one has no parent
         """
+        if self.index() is not None:
+            return self.ancestors[-1] if self.ancestors else None
         parents = self.parents()
         res = parents[-1] if len(parents) else None
         return res
 
 
+class TreeIndex:
+    """ Euler-tour index of a tree. Walking the tree from the
+    top, every node is numbered when it's entered (tourIn),
+    and when it's left (tourOut), node A is an ancestor of
+    node B if and only if A.tourIn < B.tourIn and B.tourOut
+    < A.tourOut. The parents of every node are kept too, so
+    the top of it is at hand. The index is invalidated by
+    any change of the tree, and rebuilt when used again.
+    """
+    def __init__(self, root):
+        self.valid = True
+        clock = 0
+        stack = [(root, (), False)]
+        while stack:
+            node, ancestors, leaving = stack.pop()
+            if leaving:
+                node.tourOut = clock
+                clock += 1
+                continue
+            node.treeIndex = self
+            node.tourIn    = clock
+            node.ancestors = ancestors
+            clock += 1
+            stack.append((node, ancestors, True))
+            if isinstance(node, Branch):
+                ancestors = (node,) + ancestors
+                for child in reversed(node.childNodes):
+                    stack.append((child, ancestors, False))
+
+
 class Leaf(Node): pass
 
 
@@ -109,9 +194,25 @@ class Branch(Node):
         """
         if node.parent is not None:
             raise NodeTakenException('%s is taken' % node.name)
+        self.touch()
+        node.touch()
         self.childNodes.append(node)
         node.parent = self
 
+    def attachChildren(self, nodes):
+        """ Attach all the given nodes to the branch in one step.
+        Raise exception if any of them belongs to a branch already,
+        in which case none of them is attached.
+        """
+        for node in nodes:
+            if node.parent is not None:
+                raise NodeTakenException('%s is taken' % node.name)
+        self.touch()
+        self.childNodes.extend(nodes)
+        for node in nodes:
+            node.touch()
+            node.parent = self
+
     def moveChild(self, node):
         """ Attach the given node to the branch, if the node belongs to
         a branch already, detach the node from that branch first.
@@ -129,6 +230,7 @@ class Branch(Node):
         """
         if not sure and node not in self.childNodes:
             raise NotChildException('%s is not a child' % node.name)
+        self.touch()
         node.parent = None
         self.childNodes.remove(node)
 
@@ -155,6 +257,9 @@ class Branch(Node):
         In here, 'covered' means reachable, sub-classes may extend
         it to mean more.
         """
+        if self.index() is not None and node.index() is not None:
+            return (self.treeIndex is node.treeIndex and
+                    self.tourIn < node.tourIn and node.tourOut < self.tourOut)
         class c(Collector):
             def __init__(self):
                 self.result = False
@@ -239,6 +344,679 @@ class TreeGroup:
 
 
 
+class Conflict:
+    """ Descriptor of a conflict found by a validator, instead
+    of raising an exception, a validator returns it to tell
+    what the conflict is about, the 'data' is the details,
+    like the relations of networks, the 'other' is the
+    existing object that the new one conflicts with.
+    """
+    def __init__(self, data, other=None):
+        self.data  = data
+        self.other = other
+
+
+class WorkQueue:
+    """ A first-in first-out queue of pending work, items are
+    processed in the order they are pushed, a handler pushes
+    the follow-up work of an item to the end of the queue.
+    The number of items pushed, and the maximum depth the
+    queue has reached are recorded as metrics.
+    """
+    def __init__(self, items=()):
+        self.items    = deque()
+        self.pushed   = 0
+        self.maxDepth = 0
+        for item in items:
+            self.push(item)
+
+    def __len__(self):
+        return len(self.items)
+
+    def push(self, item):
+        self.items.append(item)
+        self.pushed  += 1
+        self.maxDepth = max(self.maxDepth, len(self.items))
+
+    def pop(self):
+        return self.items.popleft()
+
+    def __iter__(self):
+        """ Pop and yield the items until the queue is
+        empty, including the ones pushed meanwhile.
+        """
+        while self.items:
+            yield self.items.popleft()
+
+    def stats(self):
+        """ Return the metrics as a text
+        """
+        return '%s items processed, max queue depth %s' % (
+                    self.pushed, self.maxDepth)
+
+
+class ExternalSort:
+    """ Sort records that may not fit in the memory. A record is
+    a tuple of integers, records are kept in memory until they
+    take about 'memLimit' bytes, then sorted and written to a
+    temporary file as a run, iterating the object merges all
+    runs into one sorted sequence, it can be iterated again.
+    """
+    recordSize = 256    # estimated memory of a buffered record
+
+    def __init__(self, memLimit, tmpDir=None):
+        self.maxRecords = max(1000, memLimit // self.recordSize)
+        self.tmpDir     = tmpDir
+        self.buffer     = []
+        self.runs       = []    # temporary files of sorted records
+        self.count      = 0
+
+    def add(self, record):
+        self.buffer.append(record)
+        self.count += 1
+        if len(self.buffer) >= self.maxRecords:
+            self.spill()
+
+    def spill(self):
+        """ Write the buffered records as a sorted run
+        """
+        self.buffer.sort()
+        run = tempfile.TemporaryFile('w+', dir=self.tmpDir)
+        run.writelines(['%s\n' % ' '.join(map(str, x)) for x in self.buffer])
+        self.runs.append(run)
+        self.buffer = []
+
+    @staticmethod
+    def readRun(run):
+        run.seek(0)
+        for line in run:
+            yield tuple(map(int, line.split()))
+
+    def __iter__(self):
+        if not self.runs:
+            self.buffer.sort()
+            return iter(self.buffer)
+        if self.buffer:
+            self.spill()
+        return heapq.merge(*[self.readRun(x) for x in self.runs])
+
+    def close(self):
+        for run in self.runs:
+            run.close()
+        self.runs   = []
+        self.buffer = []
+
+
+class Lineage:
+    """ Registry of the parts that nodes have been split into.
+    For every original name, the names of its current parts
+    are kept in a list, thus after these splits:
+
+        oldacl --> oldacl-0
+                   oldacl-1 --> oldacl-1-0
+                                oldacl-1-1
+
+    the parts of oldacl are [oldacl-0, oldacl-1-0, oldacl-1-1].
+    The registry is saved in the database as comment lines:
+
+        #@lineage oldacl oldacl-0 oldacl-1-0 oldacl-1-1
+    """
+    prefix = b'#@lineage '
+
+    def __init__(self):
+        self.data   = {}    # original name -> list of part names
+        self.origin = {}    # part name -> original name
+        self.events = []    # changes in the order they are made
+
+    def split(self, name, name0, name1):
+        """ Record that the node 'name' is split into
+        two parts, name0 and name1.
+        """
+        self.replace(name, [name0, name1])
+
+    def replace(self, name, names):
+        """ Record that the node 'name' is replaced
+        by the nodes of the 'names'.
+        """
+        self.events.append(('replace', name, list(names)))
+        origin = self.origin.pop(name, name)
+        parts  = self.data.setdefault(origin, [origin])
+        if name in parts:
+            idx = parts.index(name)
+            parts[idx:idx + 1] = names
+        else:
+            parts.extend(names)
+        for part in names:
+            self.origin[part] = origin
+
+    def merge(self, name0, name1, name):
+        """ Record that two parts of the same node, name0 and
+        name1, are merged into one named 'name'. The record
+        is dropped when the node is whole again. Return False
+        if the two are not recorded as parts of one node.
+        """
+        origin = self.origin.get(name0)
+        if origin is None or self.origin.get(name1) != origin:
+            return False
+        self.events.append(('merge', name0, name1, name))
+        parts = self.data[origin]
+        parts[parts.index(name0)] = name
+        parts.remove(name1)
+        self.origin.pop(name0)
+        self.origin.pop(name1)
+        if parts == [origin]:
+            self.data.pop(origin)
+        else:
+            self.origin[name] = origin
+        return True
+
+    def mergedName(self, name0, name1):
+        """ Return the name of the node that name0 and name1 are
+        merged back into, None if they are not the two parts of
+        one split. The records are checked first: the two only
+        parts of a node are merged into it, two recorded parts
+        named like A-0 and A-1 next to each other into A. The
+        names alone are taken only if neither one is recorded.
+        """
+        origin = self.origin.get(name0)
+        if origin is not None and self.data[origin] == [name0, name1]:
+            return origin
+        if not (name0.endswith('-0') and name1 == name0[:-2] + '-1'):
+            return None
+        if origin is None and name1 not in self.origin:
+            return name0[:-2]
+        if origin is None or self.origin.get(name1) != origin:
+            return None
+        parts = self.data[origin]
+        idx   = parts.index(name0)
+        if parts[idx + 1:idx + 2] != [name1]:
+            return None
+        return name0[:-2]
+
+    def siblingOf(self, name1):
+        """ Return the name of the part that name1 is merged
+        back with, name1 being the second one of the two, None
+        if there's no such part, see mergedName.
+        """
+        origin = self.origin.get(name1)
+        if origin is not None:
+            parts = self.data[origin]
+            if len(parts) == 2 and parts[1] == name1:
+                return parts[0]
+        if name1.endswith('-1'):
+            name0 = name1[:-2] + '-0'
+            if self.mergedName(name0, name1) is not None:
+                return name0
+        return None
+
+    def replay(self, events):
+        """ Make the changes of the 'events', which are taken
+        from the 'events' attribute of another registry, the
+        one of a worker process for example.
+        """
+        for kind, *args in events:
+            getattr(self, kind)(*args)
+
+    def parts(self, name):
+        """ Return a list of the current parts of the
+        original node 'name', None if never split.
+        """
+        parts = self.data.get(name)
+        return list(parts) if parts is not None else None
+
+    def subset(self, names):
+        """ Return a new registry which holds only the
+        records of the parts in the 'names'.
+        """
+        res = Lineage()
+        for name in names:
+            origin = self.origin.get(name)
+            if origin is not None and origin not in res.data:
+                res.data[origin] = list(self.data[origin])
+                for part in res.data[origin]:
+                    res.origin[part] = origin
+        return res
+
+    def parseLine(self, line):
+        """ Load the registry record in the line, which is a
+        bytes, return False if the line is not a record.
+        """
+        if not line.startswith(self.prefix):
+            return False
+        names = line[len(self.prefix):].decode().split()
+        if len(names) > 1:
+            origin, parts = names[0], names[1:]
+            self.data[origin] = parts
+            for part in parts:
+                self.origin[part] = origin
+        return True
+
+    def format(self):
+        """ Return the registry as a bytes of comment lines.
+        """
+        text = bytearray()
+        for origin in sorted(self.data):
+            line = ' '.join([origin] + self.data[origin])
+            text.extend(self.prefix + line.encode() + b'\n')
+        return bytes(text)
+
+
+class BlockDb:
+    """ A database file which consists of named blocks, like
+    the acl database and the view database. A block is found
+    by a regular expression whose first group is the name,
+    or by the scan method of a subclass. When saving, every
+    block is compared with the same named block of the
+    existing file by a content hash, thus the changed blocks
+    are known. With keepLayout, if the new blocks come in the
+    same order as the existing ones, the unchanged blocks and
+    the gaps between them are kept byte for byte, only the
+    changed blocks take new content, the existing file is not
+    rewritten at all if nothing changed. The file is still
+    written as a whole to a temporary file which then replaces
+    it, never modified in place, as it may be mapped by the
+    readers of the blocks. The layout is kept only if there
+    is nothing but blanks and comments between the blocks.
+    """
+    # what may be between two blocks, or after the last one
+    gapPattern = re.compile(rb'(?:\s+|(?:\#|//)[^\n]*|/\*.*?\*/)*\Z', re.S)
+
+    def __init__(self, pattern):
+        self.pattern = re.compile(pattern, re.M | re.S)
+
+    @staticmethod
+    def digest(text):
+        """ Return the hash of a bytes-like object, or a list
+        of them which together make the content of a block.
+        """
+        h = hashlib.sha1()
+        for piece in (text if isinstance(text, list) else [text]):
+            h.update(piece)
+        return h.hexdigest()
+
+    def scan(self, data):
+        """ Return a list of (name, start, end) of the
+        blocks in the data, which is a bytes.
+        """
+        return [(m.group(1).decode(), m.start(), m.end())
+                    for m in self.pattern.finditer(data)]
+
+    def covered(self, data, blocks):
+        """ Return True if the blocks, as scan returns, cover
+        the data from the first one on, but the blanks and the
+        comments between them. Otherwise a part of a block is
+        missed by the scan, the layout can't be kept.
+        """
+        starts = [x[1] for x in blocks[1:]] + [len(data)]
+        for (name, start, end), nextStart in zip(blocks, starts):
+            if not self.gapPattern.match(data, end, nextStart):
+                return False
+        return True
+
+    def save(self, dbFile, header, blocks, compareTo=None,
+             keepLayout=False):
+        """ Save the header and the blocks to the dbFile, the
+        header is a bytes, the blocks is a list of (name, text),
+        the text is a bytes-like object, or a list of them.
+        The blocks are compared with the ones in the compareTo
+        file, which defaults to the dbFile. Return a report, a
+        dict of these items:
+
+            'hashes'      list of (name, hash) of the new blocks
+            'added'       names of the new blocks
+            'removed'     names of the blocks no longer exist
+            'changed'     names of the blocks of new content
+            'written'     False if the dbFile is left untouched
+            'layoutKept'  True if the unchanged blocks were kept
+        """
+        if compareTo is None:
+            compareTo = dbFile
+        oldData   = b''
+        oldBlocks = []
+        if os.path.isfile(compareTo) and os.path.getsize(compareTo):
+            with open(compareTo, 'rb') as f:
+                oldData = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            oldBlocks = self.scan(oldData)
+        oldView   = memoryview(oldData)
+        oldHashes = {}
+        for name, start, end in oldBlocks:
+            oldHashes[name] = self.digest(oldView[start:end])
+
+        hashes   = [(name, self.digest(text)) for name, text in blocks]
+        newNames = set([x[0] for x in blocks])
+        report   = {}
+        report['hashes']  = hashes
+        report['added']   = [n for n, h in hashes if n not in oldHashes]
+        report['changed'] = [n for n, h in hashes
+                                if n in oldHashes and oldHashes[n] != h]
+        report['removed'] = [x[0] for x in oldBlocks if x[0] not in newNames]
+        report['written'] = True
+        report['layoutKept'] = False
+
+        sameOrder = [x[0] for x in oldBlocks] == [x[0] for x in blocks]
+        if (keepLayout and compareTo == dbFile and sameOrder and oldBlocks
+                and self.covered(oldData, oldBlocks)):
+            prefix = oldData[:oldBlocks[0][1]]
+            if not report['changed'] and prefix == header:
+                report['written'] = False
+                return report
+            changed = set(report['changed'])
+            pieces  = [header]
+            pos     = oldBlocks[0][1]
+            for (name, start, end), (junk, text) in zip(oldBlocks, blocks):
+                pieces.append(oldView[pos:start])   # the gap is kept
+                if name in changed:
+                    pieces.append(text)
+                else:
+                    pieces.append(oldView[start:end])
+                pos = end
+            pieces.append(oldView[pos:])
+            report['layoutKept'] = True
+        else:
+            pieces = [header] + [x[1] for x in blocks]
+
+        tmpFile = dbFile + '.tmp'
+        ofile   = open(tmpFile, 'wb')
+        for piece in pieces:
+            ofile.writelines(piece if isinstance(piece, list) else [piece])
+        ofile.close()
+        os.replace(tmpFile, dbFile)
+        return report
+
+    @staticmethod
+    def mergeReports(reports):
+        """ Merge multiple reports into one.
+        """
+        res = {'hashes': [], 'added': [], 'removed': [], 'changed': [],
+               'written': False, 'layoutKept': False}
+        for report in reports:
+            for key in ('hashes', 'added', 'removed', 'changed'):
+                res[key].extend(report[key])
+            res['written'] = res['written'] or report['written']
+            res['layoutKept'] = res['layoutKept'] or report['layoutKept']
+        return res
+
+
+class ResultCache:
+    """ Results kept in a file across runs, keyed by the hash
+    of the content they are computed from, so a result is
+    found again only for the same content. A result is any
+    value that can be written as JSON. At most 'limit'
+    results are kept, the least recently used ones are
+    dropped when saving. Every line of the file is a key
+    and its result:
+
+        <key> <result in JSON>
+
+    the ones used lately come last.
+    """
+    def __init__(self, path, limit=100000):
+        self.path   = path
+        self.limit  = limit
+        self.data   = OrderedDict()     # least recently used first
+        self.hits   = 0
+        self.misses = 0
+        if os.path.isfile(path):
+            self.load()
+
+    def load(self):
+        """ Read the results from the file, a broken line,
+        written by an interrupted program, is ignored.
+        """
+        with open(self.path) as f:
+            for line in f:
+                key, sep, text = line.partition(' ')
+                try:
+                    self.data[key] = json.loads(text)
+                except ValueError:
+                    continue
+
+    def get(self, key):
+        """ Return the result of the key, None if not cached.
+        """
+        value = self.data.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.data.move_to_end(key)
+        return value
+
+    def drop(self, key):
+        """ Forget the result of the key, one got but found not
+        to fit, it's counted as a miss instead of a hit.
+        """
+        if self.data.pop(key, None) is not None:
+            self.hits   -= 1
+            self.misses += 1
+
+    def put(self, key, value):
+        """ Cache the result of the key.
+        """
+        self.data[key] = value
+        self.data.move_to_end(key)
+
+    def save(self):
+        """ Write the most recently used results to the file.
+        """
+        while len(self.data) > self.limit:
+            self.data.popitem(last=False)
+        tmpFile = '%s.%s.tmp' % (self.path, os.getpid())
+        with open(tmpFile, 'w') as f:
+            for key, value in self.data.items():
+                f.write('%s %s\n' % (key, json.dumps(value, separators=(',', ':'))))
+        os.replace(tmpFile, self.path)
+
+    def stats(self):
+        """ Return a summary of the cache usage.
+        """
+        return 'hits %s, misses %s, entries %s' % (
+                    self.hits, self.misses, len(self.data))
+
+
+class Journal:
+    """ An append-only file of changes, every line of it is a
+    record in JSON, written at once and synced before the
+    append returns. A line without the ending newline, left
+    by an interrupted writer, is ignored. The writers hold an
+    exclusive lock of the file, the readers a shared one,
+    thus the records are never read half written:
+
+        with Journal(path) as journal:      # exclusive
+            records = journal.read()
+            journal.append([record])
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def lock(self, shared=False):
+        """ Open the file, create it if it's not shared,
+        and lock it, wait if another process holds it.
+        """
+        if shared:
+            self.file = open(self.path, 'rb')
+            fcntl.flock(self.file, fcntl.LOCK_SH)
+        else:
+            self.file = open(self.path, 'a+b')
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()       # releases the lock
+            self.file = None
+
+    def __enter__(self):
+        self.lock()
+        return self
+
+    def __exit__(self, *junk):
+        self.close()
+
+    def read(self):
+        """ Return the records, a list of tuples of the line
+        number and the record, with the file locked, or with
+        a shared lock if it's not, no record if no file.
+        """
+        if self.file is None:
+            if not os.path.isfile(self.path):
+                return []
+            self.lock(shared=True)
+            try:
+                return self.read()
+            finally:
+                self.close()
+        self.file.seek(0)
+        records = []
+        for num, line in enumerate(self.file, 1):
+            if not line.endswith(b'\n'):
+                break
+            try:
+                records.append((num, json.loads(line.decode())))
+            except ValueError:
+                raise InvalidJournalException('%s:%s' % (self.path, num))
+        return records
+
+    def append(self, records):
+        """ Append the records, the file shall be locked.
+        """
+        data = ''.join([json.dumps(x, separators=(',', ':')) + '\n'
+                        for x in records])
+        self.dropBroken()
+        self.file.write(data.encode())
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def dropBroken(self):
+        """ Cut the line an interrupted writer left at the end,
+        thus the next record starts on a line of its own.
+        """
+        end = self.file.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:
+            start = max(pos - 65536, 0)
+            self.file.seek(start)
+            chunk = self.file.read(pos - start)
+            if pos == end and chunk.endswith(b'\n'):
+                return
+            idx = chunk.rfind(b'\n')
+            if idx >= 0:
+                self.file.truncate(start + idx + 1)
+                return
+            pos = start
+        self.file.truncate(0)
+
+    def clear(self):
+        """ Drop all records, the file shall be locked.
+        """
+        self.file.truncate(0)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+
+class Span:
+    """ A span of work being traced, see Tracer. The args
+    are shown with the span, more can be added before it
+    ends. A span is true, the null span is false, thus
+    the args that take time to make can be skipped:
+
+        with Tracer.begin('split', 'acl', acl=name) as span:
+            ...
+            if span:
+                span.args['parts'] = [x.name for x in parts]
+    """
+    def __init__(self, tracer, name, category, args):
+        self.tracer   = tracer
+        self.name     = name
+        self.category = category
+        self.args     = args
+        self.start    = time.perf_counter()
+
+    def end(self):
+        """ Record the span, which ends now.
+        """
+        self.tracer.record(self, time.perf_counter())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *junk):
+        self.end()
+
+
+class NullSpan:
+    """ The span used when tracing is off, it does nothing,
+    its args are shared and read only.
+    """
+    args = types.MappingProxyType({})
+
+    def __bool__(self):
+        return False
+
+    def end(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *junk):
+        pass
+
+
+class Tracer:
+    """ Record the spans of work, the splits and the placing
+    of views for example, and save them in the Chrome trace
+    format, a JSON file which chrome://tracing or Perfetto
+    shows as a timeline, the nested spans are stacked. The
+    active tracer is Tracer.current, tracing is off when it
+    is None, in which case a span costs a function call.
+    """
+    current  = None
+    nullSpan = NullSpan()
+
+    def __init__(self, origin=None):
+        """ The times are counted from the 'origin', a value of
+        time.perf_counter, a worker process passes the one of
+        its parent, so the spans of both fit in one timeline.
+        """
+        self.origin = time.perf_counter() if origin is None else origin
+        self.events = []
+
+    @staticmethod
+    def begin(name, category, **args):
+        """ Start a span of the current tracer, return a Span,
+        or the null span when tracing is off. A span can be
+        used in a with statement, it ends when the block ends.
+        """
+        tracer = Tracer.current
+        if tracer is None:
+            return Tracer.nullSpan
+        return Span(tracer, name, category, args)
+
+    def record(self, span, end):
+        """ Add the span as a complete event, the times are
+        in microseconds.
+        """
+        self.events.append({
+            'name': span.name,
+            'cat' : span.category,
+            'ph'  : 'X',
+            'ts'  : round((span.start - self.origin) * 1e6, 3),
+            'dur' : round((end - span.start) * 1e6, 3),
+            'pid' : os.getpid(),
+            'tid' : 0,
+            'args': span.args,
+        })
+
+    def save(self, path):
+        """ Save the events in the Chrome trace format.
+        """
+        events = sorted(self.events, key=(lambda x: (x['pid'], x['ts'], -x['dur'])))
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        return len(events)
+
+
 class Collector:
     """ Record and return information
     """
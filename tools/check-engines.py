@@ -0,0 +1,528 @@
+#!/usr/bin/env python3
+"""
+Differential check of the acl and view engines. Random acl
+and view databases are generated, the results of the engines
+are compared with plain reference algorithms which work on
+(first ip, last ip) integer pairs, and the time every engine
+takes is checked against a budget.
+"""
+
+import sys, os, random, tempfile, time
+
+progPath = os.path.realpath(__file__)
+baseDir  = os.path.dirname(progPath)
+libDir   = os.path.dirname(baseDir)
+sys.path.insert(0, libDir)
+
+from acl import *
+from view import *
+
+# seconds an engine may take in one round, for the default
+# size, scaled by the -t argument
+budgets = {
+    'compare':   0.5,
+    'uniqNets':  1.0,
+    'coexist':   2.0,
+    'conflicts': 1.0,
+    'index':     1.0,
+    'split':     10.0,
+    'order':     10.0,
+    'weighted':  10.0,
+    'save':      5.0,
+    'layout':    5.0,
+    'compact':   10.0,
+    'parallel':  10.0,
+    'lookup':    5.0,
+}
+
+
+# ---- reference algorithms, on (first, last) pairs ----
+
+def refCompare(a, b):
+    """ The relation of network a to network b
+    """
+    if a == b:
+        return Network.EQUAL
+    if a[0] >= b[0] and a[1] <= b[1]:
+        return Network.LESS
+    if a[0] <= b[0] and a[1] >= b[1]:
+        return Network.GREATER
+    return Network.NOCOMMON
+
+def refUniq(nets):
+    """ The networks that no other one covers
+    """
+    nets = set(nets)
+    return set([x for x in nets
+                    if not [y for y in nets
+                            if y != x and refCompare(x, y) == Network.LESS]])
+
+def refRelations(nets1, nets2):
+    """ The LESS and GREATER pairs between two lists of networks
+    """
+    less    = set()
+    greater = set()
+    for a in nets1:
+        for b in nets2:
+            r = refCompare(a, b)
+            if r == Network.LESS:
+                less.add((a, b))
+            elif r == Network.GREATER:
+                greater.add((a, b))
+    return (less, greater)
+
+def refLess(nets1, nets2):
+    """ True if the acl of nets1 shall be placed before nets2
+    """
+    less, greater = refRelations(nets1, nets2)
+    return bool(less)
+
+def pairs(net):
+    return (net.firstInt, net.lastInt)
+
+def aclNets(acl):
+    """ The unique networks of an acl, by the reference
+    """
+    return refUniq([pairs(x) for x in acl.leaves()])
+
+
+# ---- random databases ----
+
+def randomNet(rnd, used):
+    """ A random unused network in a small address space,
+    so that networks often cover one another, one in four
+    of them is in the IPv6 space 2001:db8::/32.
+    """
+    while True:
+        if rnd.random() < 0.25:
+            maskLen  = rnd.choice([44, 46, 48, 50, 52, 54, 56, 56, 58])
+            firstInt = ipv6Base | 0x20010db8 << 96 | rnd.getrandbits(20) << 76
+            size     = 128
+        else:
+            maskLen  = rnd.choice([12, 14, 16, 18, 20, 22, 24, 24, 26])
+            firstInt = (10 << 24) | rnd.getrandbits(20) << 4
+            size     = 32
+        firstInt &= ~((1 << (size - maskLen)) - 1)
+        lastInt  = firstInt | ((1 << (size - maskLen)) - 1)
+        if (firstInt, lastInt) not in used:
+            used.add((firstInt, lastInt))
+            return Network.formatNetwork(firstInt, lastInt)
+
+def generate(rnd, aclCount, dirName):
+    """ Write a random acl database and view database to the
+    directory, return the paths of them.
+    """
+    used  = set()
+    lines = []
+    names = []
+    for i in range(aclCount):
+        name = 'A%s' % i
+        if rnd.random() < 0.2:
+            sub = 'S%s' % i
+            lines.append('acl "%s" {\n' % sub)
+            for j in range(rnd.randint(1, 3)):
+                lines.append('    ecs %s;\n' % randomNet(rnd, used))
+            lines.append('};\n')
+            lines.append('acl "%s" {\n' % name)
+            lines.append('    "%s";\n' % sub)
+        else:
+            lines.append('acl "%s" {\n' % name)
+        for j in range(rnd.randint(1, 5)):
+            lines.append('    ecs %s;\n' % randomNet(rnd, used))
+        lines.append('};\n')
+        names.append(name)
+    aclPath = os.path.join(dirName, 'acl.conf')
+    open(aclPath, 'w').write(''.join(lines))
+
+    lines = []
+    for name in names + ['ANY']:
+        lines.append('view "%s" {\n' % name)
+        lines.append('    match-clients { key %s; %s; };\n' % (name.lower(), name))
+        lines.append('    include "zones/%s";\n' % name)
+        if rnd.random() < 0.25:
+            # a nested block closed at the start of a line
+            lines.append('    zone "%s" {\n        type hint;\n};\n' % name.lower())
+        lines.append('};\n\n')
+    viewPath = os.path.join(dirName, 'view.conf')
+    open(viewPath, 'w').write(''.join(lines))
+    return (viewPath, aclPath)
+
+
+# ---- checks, every one returns a list of failure messages ----
+
+def checkCompare(ag, rnd):
+    nets = [x for x in ag.data.values() if isinstance(x, Network)]
+    res  = []
+    for i in range(2000):
+        a, b = rnd.choice(nets), rnd.choice(nets)
+        if a.compare(b) != refCompare(pairs(a), pairs(b)):
+            res.append('compare %s %s' % (a, b))
+    return res
+
+def checkUniqNets(ag, rnd):
+    res = []
+    for acl in [x for x in ag.data.values() if isinstance(x, Acl)]:
+        got = set([pairs(x) for x in acl.networks()])
+        if got != aclNets(acl):
+            res.append('networks of %s' % acl.name)
+        direct = [pairs(x) for x in acl.childNodes if isinstance(x, Network)]
+        got    = [pairs(x) for x in acl.directUniqNetworks()]
+        if len(got) != len(set(got)) or set(got) != refUniq(direct):
+            res.append('direct networks of %s' % acl.name)
+    return res
+
+def topAcls(ag):
+    return [x for x in ag.data.values()
+                if isinstance(x, Acl) and x.parent is None]
+
+def checkCoexist(ag, rnd):
+    res  = []
+    tops = topAcls(ag)
+    nets = dict([(x, aclNets(x)) for x in tops])
+    for i, acl1 in enumerate(tops):
+        for acl2 in tops[i+1:]:
+            less, greater = refRelations(nets[acl1], nets[acl2])
+            stat, relations = ag.coexist(acl1, acl2)
+            expected = not (less and greater)
+            if stat != expected:
+                res.append('coexist %s %s' % (acl1.name, acl2.name))
+            elif not stat:
+                l_rela, g_rela = relations
+                if (set([(pairs(x), pairs(y)) for x, y in l_rela]) != less or
+                    set([(pairs(x), pairs(y)) for x, y in g_rela]) != greater):
+                    res.append('relations %s %s' % (acl1.name, acl2.name))
+    return res
+
+def checkConflicts(ag, rnd):
+    res      = []
+    tops     = topAcls(ag)
+    nets     = dict([(x, aclNets(x)) for x in tops])
+    expected = set()
+    for i, acl1 in enumerate(tops):
+        for acl2 in tops[i+1:]:
+            less, greater = refRelations(nets[acl1], nets[acl2])
+            if less and greater:
+                expected.add(frozenset([acl1.name, acl2.name]))
+    got = set()
+    for acl1, acl2, l_rela, g_rela in ag.findConflicts():
+        got.add(frozenset([acl1.name, acl2.name]))
+        less, greater = refRelations(nets[acl1], nets[acl2])
+        if (set([(pairs(x), pairs(y)) for x, y in l_rela]) != less or
+            set([(pairs(x), pairs(y)) for x, y in g_rela]) != greater):
+            res.append('conflict relations %s %s' % (acl1.name, acl2.name))
+    for pair in expected ^ got:
+        res.append('conflict pair %s' % ' '.join(sorted(pair)))
+    return res
+
+def checkIndex(ag, rnd):
+    res = []
+    for node in ag.data.values():
+        Node.useIndex = True
+        fast = (node.parents(), node.topParent())
+        Node.useIndex = False
+        slow = (node.parents(), node.topParent())
+        if fast[0] != slow[0] or fast[1] is not slow[1]:
+            res.append('parents of %s' % node.name)
+    Node.useIndex = True
+    return res
+
+def checkSplit(ag, origin):
+    """ No conflict is left, and every original top acl covers
+    the same addresses with its parts as before.
+    """
+    res  = []
+    tops = topAcls(ag)
+    nets = dict([(x, aclNets(x)) for x in tops])
+    for i, acl1 in enumerate(tops):
+        for acl2 in tops[i+1:]:
+            less, greater = refRelations(nets[acl1], nets[acl2])
+            if less and greater:
+                res.append('left conflict %s %s' % (acl1.name, acl2.name))
+    for name, oldNets in origin.items():
+        parts = ag.lineage.parts(name) or [name]
+        newNets = set()
+        for part in parts:
+            if part not in ag.data:
+                res.append('missing part %s of %s' % (part, name))
+                continue
+            newNets |= aclNets(ag.data[part])
+        if refUniq(newNets) != oldNets:
+            res.append('addresses of %s changed' % name)
+    return res
+
+def checkOrder(vg, origin):
+    """ No view is placed after one it is LESS than, the
+    default view is the last, and the parts of every
+    original view cover the same addresses as before.
+    """
+    res   = []
+    views = vg.outputViews()
+    if vg.defaultView is not None and views[-1] is not vg.defaultView:
+        res.append('default view not the last')
+    views = [x for x in views if x is not vg.defaultView]
+    nets  = dict([(x.name, aclNets(vg.acls[x.aclName])) for x in views])
+    for i, view1 in enumerate(views):
+        for view2 in views[i+1:]:
+            if refLess(nets[view2.name], nets[view1.name]):
+                res.append('view %s after %s' % (view2.name, view1.name))
+    byName = dict([(x.name, x) for x in views])
+    for name, oldNets in origin.items():
+        parts = vg.lineage.parts(name) or [name]
+        newNets = set()
+        for part in parts:
+            if part in byName:
+                newNets |= nets[part]
+        if refUniq(newNets) != oldNets:
+            res.append('addresses of view %s changed' % name)
+    return res
+
+def checkSave(ag, vg, dirName):
+    """ The saved databases load back to the same views and
+    networks, saving them again with keepLayout changes
+    nothing.
+    """
+    res      = []
+    viewPath = os.path.join(dirName, 'new-view.conf')
+    aclPath  = os.path.join(dirName, 'new-acl.conf')
+    heads    = [v for v in vg.acls.values() if v.parent is None]
+    AclGroup.save(heads, aclPath, ag.lineage)
+    vg.save(viewPath)
+
+    ag2 = AclGroup()
+    ag2.load(aclPath, remove_conflict=False)
+    vg2 = ViewGroup(acls=ag2.data, aclLineage=ag2.lineage)
+    vg2.load(viewPath)
+    names1 = [x.name for x in vg.outputViews()]
+    names2 = [x.name for x in vg2.data] + [x.name for x in [vg2.defaultView] if x]
+    if names1 != names2:
+        res.append('views not saved in order')
+    for view in vg2.data:
+        if aclNets(ag2.data[view.aclName]) != aclNets(vg.acls[view.aclName]):
+            res.append('networks of view %s not saved' % view.name)
+
+    heads = [v for v in ag2.data.values()
+                if isinstance(v, Acl) and v.parent is None]
+    report = AclGroup.save(heads, aclPath, ag2.lineage, keepLayout=True)
+    if report['written']:
+        res.append('acl database rewritten without change')
+    vg2.order()
+    report = vg2.save(viewPath, keepLayout=True)
+    if report['written']:
+        res.append('view database rewritten without change')
+    return res
+
+
+def checkLayout(vg, dirName):
+    """ A view changed and saved again with keepLayout gives
+    the same file as a whole save, a nested block closed at
+    the start of a line does not end the view.
+    """
+    res       = []
+    viewPath  = os.path.join(dirName, 'layout-view.conf')
+    wholePath = os.path.join(dirName, 'whole-view.conf')
+    vg.save(viewPath)
+    view   = vg.outputViews()[0]
+    config = view.otherConfig
+    view.otherConfig = bytes(config) + b'    recursion no;\n'
+    report = vg.save(viewPath, keepLayout=True)
+    vg.save(wholePath)
+    view.otherConfig = config
+    if not report['layoutKept'] or report['changed'] != [view.name]:
+        res.append('layout of the view database not kept')
+    if open(viewPath, 'rb').read() != open(wholePath, 'rb').read():
+        res.append('view database differs from a whole save')
+    return res
+
+def checkParallel(aclPath, viewPath, strategy, dirName):
+    """ The views ordered by components in worker processes
+    are saved the same as the ones saved by checkSave.
+    """
+    res = []
+    ag  = AclGroup()
+    ag.strategy = strategy
+    ag.load(aclPath, remove_conflict=True)
+    vg  = ViewGroup(acls=ag.data, aclLineage=ag.lineage)
+    vg.load(viewPath)
+    vg.order(jobs=2)
+    heads = [v for v in vg.acls.values() if v.parent is None]
+    for kind, save in [('acl', lambda x: AclGroup.save(heads, x, ag.lineage)),
+                       ('view', vg.save)]:
+        path = os.path.join(dirName, 'parallel-%s.conf' % kind)
+        save(path)
+        serial = open(os.path.join(dirName, 'new-%s.conf' % kind), 'rb').read()
+        if open(path, 'rb').read() != serial:
+            res.append('%s database differs from the serial one' % kind)
+    return res
+
+
+def checkLookup(vg, dirName, rnd):
+    """ The lookup table gives every address the first view
+    whose networks cover it, at the ends of all networks,
+    next to them, and at random addresses.
+    """
+    res   = []
+    path  = os.path.join(dirName, 'view.tbl')
+    views = [x for x in vg.outputViews() if x is not vg.defaultView]
+    vg.saveLookupTable(path)
+    table = LookupTable(path)
+    nets  = [(x.name, aclNets(vg.acls[x.aclName])) for x in views]
+    addrs = set([0, 0xffffffff, ipv6Base, ipv6Base * 2 - 1])
+    addrs.update([rnd.randrange(1 << 32) for i in range(200)])
+    addrs.update([ipv6Base + rnd.randrange(1 << 128) for i in range(100)])
+    addrs.update([ipv6Base + (0x20010db8 << 96) + rnd.randrange(1 << 100)
+                  for i in range(100)])
+    for name, netPairs in nets:
+        for first, last in netPairs:
+            addrs.update([first - 1, first, last, last + 1])
+    addrs = [x for x in addrs if 0 <= x <= 0xffffffff or
+                                 ipv6Base <= x < ipv6Base * 2]
+    default = vg.defaultView.name if vg.defaultView else None
+    for addr in sorted(addrs):
+        expect = default
+        for name, netPairs in nets:
+            if any([x <= addr <= y for x, y in netPairs]):
+                expect = name
+                break
+        if table.find(addr) != expect:
+            res.append('address %s in %s, not %s' % (addr, table.find(addr), expect))
+    table.close()
+    return res
+
+
+class Result:
+    """ Failures and the longest time of a check
+    """
+    def __init__(self):
+        self.failures = []
+        self.maxTime  = 0.0
+
+    def record(self, seed, budget, func, *args):
+        start = time.time()
+        failures = func(*args)
+        spent = time.time() - start
+        self.maxTime = max(self.maxTime, spent)
+        for failure in failures:
+            self.failures.append('seed %s: %s' % (seed, failure))
+        if spent > budget:
+            self.failures.append('seed %s: %.2fs over the budget %.2fs' %
+                                    (seed, spent, budget))
+
+def runRound(seed, aclCount, scale, results):
+    rnd = random.Random(seed)
+    with tempfile.TemporaryDirectory() as dirName:
+        viewPath, aclPath = generate(rnd, aclCount, dirName)
+
+        def record(name, func, *args):
+            results.setdefault(name, Result()).record(
+                    seed, budgets[name.split(':')[0]] * scale, func, *args)
+
+        ag = AclGroup()
+        ag.load(aclPath, remove_conflict=False)
+        origin = dict([(x.name, aclNets(x)) for x in topAcls(ag)])
+        record('compare', checkCompare, ag, rnd)
+        record('uniqNets', checkUniqNets, ag, rnd)
+        record('coexist', checkCoexist, ag, rnd)
+        record('conflicts', checkConflicts, ag, rnd)
+        record('index', checkIndex, ag, rnd)
+
+        for strategy in AclGroup.strategies:
+            ag = AclGroup()
+            ag.strategy = strategy
+            def split():
+                ag.load(aclPath, remove_conflict=True)
+                return checkSplit(ag, origin)
+            record('split:' + strategy, split)
+
+            vg = ViewGroup(acls=ag.data, aclLineage=ag.lineage)
+            vg.load(viewPath)
+            viewOrigin = dict([('A%s' % i, origin['A%s' % i])
+                                for i in range(aclCount)])
+            def order():
+                vg.order()
+                return checkOrder(vg, viewOrigin)
+            record('order:' + strategy, order)
+            def weighted():
+                vg.weights = dict([('A%s' % i, rnd.randint(0, 1000))
+                                    for i in range(aclCount)])
+                res = checkOrder(vg, viewOrigin)
+                if vg.matchCost(vg.outputViews()) > vg.matchCost(vg.outputViews(False)):
+                    res.append('weighted order costs more')
+                vg.weights = {}
+                return res
+            record('weighted:' + strategy, weighted)
+            record('lookup:' + strategy, checkLookup, vg, dirName, rnd)
+            record('save:' + strategy, checkSave, ag, vg, dirName)
+            record('layout:' + strategy, checkLayout, vg, dirName)
+            record('parallel:' + strategy, checkParallel, aclPath,
+                    viewPath, strategy, dirName)
+            def compact():
+                ag = AclGroup()
+                ag.load(os.path.join(dirName, 'new-acl.conf'),
+                        remove_conflict=False)
+                vg = ViewGroup(acls=ag.data, aclLineage=ag.lineage)
+                vg.load(os.path.join(dirName, 'new-view.conf'))
+                vg.compact(ag)
+                vg.orderByGraph()
+                return checkSplit(ag, origin) + checkOrder(vg, viewOrigin)
+            record('compact:' + strategy, compact)
+
+def run(args):
+    """ Run the rounds, report the result of every check
+    """
+    rounds   = 20
+    seed     = 1
+    aclCount = 40
+    scale    = 1.0
+    while args:
+        arg = args.pop(0)
+        if arg == '-n':
+            rounds = int(args.pop(0))
+        elif arg == '-s':
+            seed = int(args.pop(0))
+        elif arg == '-a':
+            aclCount = int(args.pop(0))
+        elif arg == '-t':
+            scale = float(args.pop(0))
+        else:
+            raise Exception("unknown argument: %s" % arg)
+
+    Node.useIndex = True
+    results = {}
+    for n in range(seed, seed + rounds):
+        runRound(n, aclCount, scale, results)
+
+    state = 0
+    print('%-18s %8s %10s' % ('check', 'failures', 'max time'))
+    for name, result in results.items():
+        print('%-18s %8s %9.2fs' % (name, len(result.failures), result.maxTime))
+    for name, result in results.items():
+        for failure in result.failures[:10]:
+            print('%s: %s' % (name, failure), file=sys.stderr)
+        if result.failures:
+            state = 1
+    exit(state)
+
+
+def help():
+    bname = os.path.basename(sys.argv[0])
+    text = 'Usage: %s [-n rounds] [-s first-seed] [-a acls] [-t budget-scale]' % bname
+    print(text)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    try:
+        run(args)
+    except AssertionError as e:
+        print(e, file=sys.stderr)
+        help()
+        exit(1)
+    except Exception as e:
+        text = str(e).split('] ')[-1]
+        if not text:
+            text = '-- no error message --'
+        print(text, file=sys.stderr)
+        help()
+        exit(1)
+    except KeyboardInterrupt:
+        exit(1)
@@ -0,0 +1,13 @@
+#!/bin/bash
+# Count the queries of every view in the query log,
+# the output is the weights file for the
+# 'vman fix-view --weights' command.
+
+if test $# -lt 1; then
+    echo "Usage: $(basename $0) query-log [query-log]..." >&2
+    exit 1
+fi
+
+# a query log record contains "view NAME: query:"
+cat "$@" | grep -o 'view [^ :]*: query:' | awk '{print $2}' | tr -d ':' \
+    | sort | uniq -c | awk '{print $2, $1}' | sort -k2 -n -r
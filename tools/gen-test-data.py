@@ -55,17 +55,13 @@ def generate(args):
         seq += 1
 
 def numToIp(number):
-    """ Convert the number to an IPv4 address string
+    """ Convert the number to an address string, an IPv6
+    one if it's offset by ipv6Base, see acl.parseAddress
     """
-    s      = bin(number)[2:]
-    p4, s  = s[-8:], s[:-8]
-    p3, s  = s[-8:], s[:-8]
-    p2, p1 = s[-8:], s[:-8]
-    return '%s.%s.%s.%s/32' % (
-                int(p1, base=2),
-                int(p2, base=2),
-                int(p3, base=2),
-                int(p4, base=2))
+    if number >= ipv6Base:
+        return '%s/128' % formatIpv6(number - ipv6Base)
+    numbers = [str((number >> s) & 0xff) for s in (24, 16, 8, 0)]
+    return '%s/32' % '.'.join(numbers)
 
 def out(seq, ip, viewName):
     suffix = 'abc.com'
@@ -8,9 +8,203 @@ to maintain a View database.
 """
 from lib import *
 from acl import *
+from array import array
+import bisect
+import heapq
+import io
+import mmap
+import multiprocessing
+import os
 import re
+import struct
 import sys
 
+def readWeights(path):
+    """ Read the query counts from a file, every line of it is
+    a view name or an acl name, and the number of queries, for
+    example counted from the query log:
+
+        GD_CTC  120034
+        CQ_CTC  3021
+
+    empty lines and lines start with '#' are ignored. Return
+    a dict of the names to the counts.
+    """
+    weights = {}
+    for num, line in enumerate(open(path), 1):
+        fields = line.split()
+        if not fields or fields[0].startswith('#'):
+            continue
+        if len(fields) != 2 or not fields[1].isdigit():
+            raise Exception("invalid weight at %s:%s" % (path, num))
+        weights[fields[0]] = weights.get(fields[0], 0) + int(fields[1])
+    return weights
+
+
+# tokens of the view database: a string, a comment, a brace, the
+# end of a statement or a bare word, the rest are blanks. A string
+# or a comment may be cut at the end of the buffer. Inside a block
+# only the tokens that may hold or be a brace matter.
+topToken   = re.compile(rb"""
+      "(?:[^"\\]|\\.)*(?:"|\\?\Z)
+    | (?:\#|//)[^\n]*
+    | /\*(?s:.*?)(?:\*/|\Z)
+    | [{};]
+    | [^\s{};"\#/]+
+""", re.X)
+blockToken = re.compile(rb"""
+      "(?:[^"\\]|\\.)*(?:"|\\?\Z)
+    | (?:\#|//)[^\n]*
+    | /\*(?s:.*?)(?:\*/|\Z)
+    | [{}]
+""", re.X)
+
+# a view of the common form, whose lines have no comment, and no
+# block but one on a single line, it's taken in one match, the
+# runs are possessive, so a view not of the form fails at once
+simpleView = re.compile(rb"""
+    \s*(view)[ \t]+"([^"\\\n{}]*)"[ \t]*(\{)[ \t]*\n
+    (?:(?:[^{}"\#/\n]++|/(?![/*])|"[^"\\\n{}]*+"
+         |\{(?:[^{}"\#/\n]++|/(?![/*])|"[^"\\\n{}]*+")*+\})*+\n)*+
+    [ \t]*(\});
+""", re.X)
+
+def scanViewDb(stream, chunkSize=1 << 20):
+    """ Read the view database from the binary 'stream' chunk
+    by chunk, yield a tuple for every view statement:
+
+        (name, start, open, close, end)
+
+    the name of the view, and the offsets of the 'view' word,
+    the opening brace and the closing brace of the view, and
+    the end of the statement, past the ';'. Braces are counted,
+    the strings and the comments are skipped, so the braces and
+    the word 'view' in them are not taken, nor the ones of the
+    nested blocks. Other statements at the top are skipped.
+    A view of the common form is taken by a single match of
+    the simpleView pattern, without going through its tokens.
+    Raise InvalidViewConfigException on an unbalanced brace,
+    or a view without a block.
+    """
+    buf   = b''
+    base  = 0       # offset of the buf in the stream
+    pos   = 0
+    eof   = False
+    depth = 0
+    fresh = True    # at the start of a statement
+    view  = None    # [name, start, open, close] of the current view
+    while True:
+        if not depth and fresh and view is None:
+            m = simpleView.match(buf, pos)
+            if m:
+                yield (m.group(2).decode(), base + m.start(1),
+                       base + m.start(3), base + m.start(4), base + m.end())
+                pos = m.end()
+                continue
+        m = (blockToken if depth else topToken).search(buf, pos)
+        if m is None or (m.end() == len(buf) and not eof):
+            if eof:
+                break
+            # read more, keep the token that may be cut
+            keep  = m.start() if m else len(buf) - buf.endswith(b'/')
+            chunk = stream.read(chunkSize)
+            eof   = not chunk
+            buf   = buf[keep:] + chunk
+            base += keep
+            pos   = 0
+            continue
+        token = m.group()
+        pos   = m.end()
+        if token[:1] == b'#' or token[:2] in (b'//', b'/*'):
+            continue        # a comment is a blank
+        if token[:1] == b'"':
+            if view and view[0] is None and view[2] is None:
+                view[0] = token[1:-1].decode()
+        elif token == b'{':
+            depth += 1
+            if depth == 1 and view and view[2] is None:
+                view[2] = base + m.start()
+        elif token == b'}':
+            depth -= 1
+            if depth < 0:
+                raise InvalidViewConfigException
+            if depth == 0 and view and view[3] is None:
+                view[3] = base + m.start()
+        elif token == b';':
+            if view:
+                if view[0] is None or view[3] is None:
+                    raise InvalidViewConfigException
+                yield tuple(view) + (base + pos,)
+                view = None
+            fresh = True
+            continue
+        elif fresh and token == b'view':
+            view = [None, base + m.start(), None, None]
+        elif view and view[0] is None and view[2] is None:
+            view[0] = token.decode()
+        fresh = False
+    if depth or view:
+        raise InvalidViewConfigException
+
+
+class ViewBlockDb(BlockDb):
+    """ The view database as a BlockDb, the views are found by
+    scanViewDb, the same as preproc does, so there's only one
+    idea of where a view ends, one whose nested block closes at
+    the start of a line is taken as a whole. A block runs from
+    the 'view' word past the ';' and the newline, along with a
+    following empty line, the way formatView writes it.
+    """
+    def __init__(self):
+        pass
+
+    def scan(self, data):
+        """ Return a list of (name, start, end) of the views
+        in the data, a bytes or a mmap. A database that can't
+        be scanned has no block, it's written as a whole.
+        """
+        if isinstance(data, mmap.mmap):
+            data.seek(0)
+            stream = data
+        else:
+            stream = io.BytesIO(data)
+        res = []
+        try:
+            for name, start, lbrace, rbrace, end in scanViewDb(stream):
+                for junk in range(2):
+                    if data[end:end + 1] == b'\n':
+                        end += 1
+                res.append((name, start, end))
+        except InvalidViewConfigException:
+            return []
+        return res
+
+
+def orderComponent(task):
+    """ Place the views of a component in a worker process,
+    return the placed views, the acls, the changes of the
+    lineages, the metrics of the queue and the spans traced,
+    see the method ViewGroup.orderComponents.
+    """
+    views, acls, verbose = task
+    if Tracer.current is not None:  # a copy of the parent's
+        Tracer.current = Tracer(Tracer.current.origin)
+    anyAdded = 'ANY' not in acls
+    group    = ViewGroup(acls=acls)
+    group.verbose = verbose
+    for view in views:
+        group.placeView(view)
+    if anyAdded:
+        acls.pop('ANY')     # added by the group, not shipped
+    relations = group.relations
+    spans     = Tracer.current.events if Tracer.current else []
+    return (group.outData, acls, group.lineage.events,
+            group.aclLineage.events, group.queue.pushed,
+            group.queue.maxDepth,
+            (relations.disjoint, relations.hits, relations.misses,
+             relations.stale), spans)
+
+
 class View:
     """ Represents a view entry in the view database.
     When we process the view config, only the view name
@@ -18,20 +212,25 @@ class View:
     will be simply treated as 'other config' and
     remain intact.
     """
+    firstLine = re.compile(b'[^\n]*')
+
     def __init__(self, name, aclName, otherConfig):
-        """ name and aclName are str, otherConfig is bytes
+        """ name and aclName are str, otherConfig is bytes,
+        or a memoryview of the view database, which ends
+        with a newline unless it's empty.
         """
         self.name        = name
         self.aclName     = aclName      # str
         self.otherConfig = otherConfig  # bytes
 
     @staticmethod
-    def parseConfig(lines):
-        """ extract the ACL info from the config lines which
-        is a list of bytes, return the ACL name as a str,
-        and the rest of the view config as a list of bytes.
-        The line which contains the ACL info shall be the
-        first line of the 'lines'
+    def parseConfig(config):
+        """ extract the ACL info from the config which is a
+        bytes-like object, usually a memoryview of the view
+        database, return the ACL name as a str, and the rest
+        of the view config as a slice of the 'config'. The
+        line which contains the ACL info shall be the first
+        line of the 'config'.
 
         For this view config code in the view database:
 
@@ -49,13 +248,203 @@ class View:
             ... other view config lines
             ...
 
+        and the rest is the last three lines.
         """
-        acl_line   = lines[0]
+        match    = View.firstLine.match(config)
+        acl_line = match.group(0)
         if not re.match(b'\s*match-clients\s', acl_line):
             raise InvalidViewConfigException
-        rest_lines = lines[1:]
-        aclName    = acl_line.split(b';')[-3].decode().strip()
-        return (aclName, rest_lines)
+        rest     = config[match.end() + 1:]
+        aclName  = acl_line.split(b';')[-3].decode().strip()
+        return (aclName, rest)
+
+
+class LookupTable:
+    """ A compiled table of the view BIND picks for a client
+    address. The address space is cut into ranges at the ends
+    of the networks of the views, the start addresses of the
+    ranges are kept sorted, along with the view of every range,
+    thus a lookup is a binary search. The IPv4 ranges and the
+    IPv6 ones are kept apart, an IPv6 start address, without
+    the ipv6Base, is split into the high and the low 64 bits.
+    The table file is:
+
+        magic       8 bytes, b'VMANLKP2'
+        counts      4 little-endian uint32, the number of the
+                    IPv4 ranges, of the IPv6 ranges, of the
+                    views, and the size of the names
+        names       names of the views, separated by newlines,
+                    padded with zeros to a multiple of 8 bytes
+        starts      a little-endian uint32 for every IPv4 range
+        views       a little-endian uint32 for every IPv4 range,
+                    the index of the view in the names,
+                    0xffffffff if no view matches
+        highs       a little-endian uint64 for every IPv6 range
+        lows        a little-endian uint64 for every IPv6 range
+        views6      a little-endian uint32 for every IPv6 range
+
+    A table of the version 1, whose magic is b'VMANLKP1', has
+    no IPv6 ranges, and 3 counts. The file is memory mapped
+    when loaded, not read.
+    """
+    magic   = b'VMANLKP2'
+    magic1  = b'VMANLKP1'
+    header  = struct.Struct('<8sIIII')
+    header1 = struct.Struct('<8sIII')
+    noView  = 0xffffffff
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic = self.source[:8]
+        if magic == self.magic:
+            junk, count, count6, nameCount, nameSize = \
+                    self.header.unpack_from(self.source)
+            pos, align = self.header.size, 8
+        elif magic == self.magic1:
+            junk, count, nameCount, nameSize = \
+                    self.header1.unpack_from(self.source)
+            pos, align, count6 = self.header1.size, 4, 0
+        else:
+            raise Exception("not a lookup table: %s" % path)
+        names = bytes(self.source[pos:pos + nameSize]).decode()
+        self.names = names.split('\n') if nameCount else []
+        pos  += nameSize + (-nameSize % align)
+        buf   = memoryview(self.source)
+        self.starts = self.uintArray(buf[pos:pos + count * 4])
+        self.views  = self.uintArray(buf[pos + count * 4:pos + count * 8])
+        pos  += count * 8
+        self.highs  = self.uintArray(buf[pos:pos + count6 * 8], 'Q')
+        self.lows   = self.uintArray(buf[pos + count6 * 8:pos + count6 * 16], 'Q')
+        self.views6 = self.uintArray(buf[pos + count6 * 16:pos + count6 * 20])
+
+    @staticmethod
+    def uintArray(buf, typecode='I'):
+        """ View the little-endian unsigned array in the buffer
+        as a sequence of int, without copying it if possible,
+        the typecode is 'I' for uint32, 'Q' for uint64.
+        """
+        if sys.byteorder == 'little':
+            return buf.cast(typecode)
+        res = array(typecode, bytes(buf))
+        res.byteswap()
+        return res
+
+    def find(self, ip):
+        """ Return the name of the view for the address 'ip',
+        an int, None if no view matches.
+        """
+        if ip < ipv6Base:
+            idx  = bisect.bisect_right(self.starts, ip) - 1
+            view = self.views[idx] if idx >= 0 else self.noView
+        else:
+            ip  -= ipv6Base
+            high = ip >> 64
+            low  = ip & 0xffffffffffffffff
+            lo   = bisect.bisect_left(self.highs, high)
+            hi   = bisect.bisect_right(self.highs, high, lo)
+            idx  = bisect.bisect_right(self.lows, low, lo, hi) - 1
+            if idx < lo:    # the last range of a lower high
+                idx = lo - 1
+            view = self.views6[idx] if idx >= 0 else self.noView
+        if view == self.noView:
+            return None
+        return self.names[view]
+
+    def close(self):
+        for x in (self.starts, self.views, self.highs, self.lows, self.views6):
+            if isinstance(x, memoryview):
+                x.release()
+        self.source.close()
+
+    @staticmethod
+    def compile(views, acls, defaultView=None):
+        """ Return the ranges of the views as two lists, the
+        start addresses, and the indexes of the views, in the
+        'views' list, or noView. The views are in the order
+        BIND tests them, an address goes to the first view
+        that matches it, the addresses no network covers go
+        to the defaultView, whose index follows the views.
+        Networks never partially overlap, in the order of
+        (first address, -last address), the networks that
+        cover the current one are on a stack, every entry of
+        it keeps the first view of the networks under it.
+        """
+        other = len(views) if defaultView is not None else LookupTable.noView
+        nets  = []
+        for rank, view in enumerate(views):
+            for net in acls[view.aclName].networks():
+                nets.append((net.firstInt, -net.lastInt, rank))
+        nets.sort()
+
+        starts  = []
+        indexes = []
+        def emit(start, idx):
+            if starts and starts[-1] == start:  # replaced at once
+                starts.pop()
+                indexes.pop()
+            if not indexes or indexes[-1] != idx:
+                starts.append(start)
+                indexes.append(idx)
+
+        emit(0, other)
+        stack = []      # (last address, first view)
+        for first, last, rank in nets:
+            last = -last
+            while stack and stack[-1][0] < first:
+                end = stack.pop()[0]
+                emit(end + 1, stack[-1][1] if stack else other)
+            if stack:
+                rank = min(rank, stack[-1][1])
+            emit(first, rank)
+            stack.append((last, rank))
+        while stack:
+            end = stack.pop()[0]
+            if end not in (0xffffffff, ipv6Base * 2 - 1):
+                emit(end + 1, stack[-1][1] if stack else other)
+        return (starts, indexes)
+
+    @staticmethod
+    def save(path, views, acls, defaultView=None):
+        """ Compile the views, see the compile method, and
+        save the table to the file 'path'. Return the number
+        of the ranges.
+        """
+        starts, indexes = LookupTable.compile(views, acls, defaultView)
+        names = [x.name for x in views]
+        if defaultView is not None:
+            names.append(defaultView.name)
+        nameData = '\n'.join(names).encode()
+
+        # no network spans the two families, the IPv6 ranges
+        # start from the ipv6Base, with the default view if no
+        # network starts there, the addresses in between are
+        # never looked up
+        other  = len(views) if defaultView is not None else LookupTable.noView
+        split  = bisect.bisect_left(starts, 1 << 32)
+        split6 = bisect.bisect_left(starts, ipv6Base)
+        starts6, indexes6 = starts[split6:], indexes[split6:]
+        if not starts6 or starts6[0] != ipv6Base:
+            starts6.insert(0, ipv6Base)
+            indexes6.insert(0, other)
+        starts6 = [x - ipv6Base for x in starts6]
+        arrays  = [array('I', starts[:split]), array('I', indexes[:split]),
+                   array('Q', [x >> 64 for x in starts6]),
+                   array('Q', [x & 0xffffffffffffffff for x in starts6]),
+                   array('I', indexes6)]
+        if sys.byteorder != 'little':
+            for x in arrays:
+                x.byteswap()
+
+        tmpFile = path + '.tmp'
+        with open(tmpFile, 'wb') as ofile:
+            ofile.write(LookupTable.header.pack(LookupTable.magic,
+                        split, len(starts6), len(names), len(nameData)))
+            ofile.write(nameData + b'\0' * (-len(nameData) % 8))
+            for x in arrays:
+                ofile.write(x.tobytes())
+        os.replace(tmpFile, path)
+        return split + len(starts6)
 
 
 class ViewGroup:
@@ -100,53 +489,66 @@ class ViewGroup:
     # control how verbose the program will be
     verbose = 0
 
-    def __init__(self, acls={}):
+    def __init__(self, acls={}, aclLineage=None):
         """
         self.data holds all unprocessed views.
         self.outData holds all ready-for-output views.
         self.outData['free'] holds all views that have
             no LESS or GREATER relationship with others,
-            the order of it does not matter.
+            the order of it does not matter. It's a dict
+            whose keys are the views, for quick removal.
         self.outData['ordered'] holds multiple lists,
             each list is a group of views which must be
             ordered. The order of the lists does not
             matter, but the order of views in each list
-            does.
+            does. It's a dict, the keys are serial numbers
+            of the lists, for quick removal.
         self.acls is the acl data the views will use.
+        self.aclLineage records the parts of split acls.
+        self.lineage records the parts of split views.
+        self.queue holds the views to be placed.
+        self.weights holds the query counts of the views,
+            or of the acls, keyed by the name.
+        self.relations caches the relations of the acls.
         """
         self.data               = []
         self.outData            = {}
-        self.outData['free']    = []
-        self.outData['ordered'] = []
-        self.attachAclDb(acls)
+        self.outData['free']    = {}
+        self.outData['ordered'] = {}
+        self.listSerial         = 0
+        self.lineage            = Lineage()
+        self.queue              = WorkQueue()   # pending views to be placed
+        self.weights            = {}
+        self.relations          = RelationCache()
+        self.attachAclDb(acls, aclLineage)
 
-    def attachAclDb(self, acls):
+    def attachAclDb(self, acls, lineage=None):
         """ Add the acl database for the ViewGroup to use
         The acls is a dictionary, the key is the acl name,
         and the value is the acl object. The view database
         usually make use of a preset acl named 'ANY' for
         default selection, here we ensure that acl exists.
+        The lineage is the registry of the split acls, it's
+        usually the one of the AclGroup which owns the acls.
         """
         anyName = 'ANY'
         if anyName not in acls:
             acls[anyName] = Acl(anyName)
-        self.acls = acls
+        self.acls       = acls
+        self.aclLineage = lineage if lineage is not None else Lineage()
 
     def load(self, dbFile, resolveParts=True):
         """ Load data from a database, the existing
         data of the group will be abandoned. The
         'ANY' view shall be separated from others.
+        The database is memory mapped, the config
+        of the views are slices of it, not copies.
         """
-        self.data = []
-        viewBlocks = self.preproc(dbFile)
-        for block in viewBlocks:
-            lines = block.split(b'\n')
-            view_name = lines[0].split(b'"')[1].decode()
-            n = self.locateLine(lines, b'^};')
-            if n is None:
-                raise InvalidViewConfigException
-            lines = lines[1:n]
-            parsed = View.parseConfig(lines)
+        self.data    = []
+        self.lineage = Lineage()
+        viewBlocks   = self.preproc(dbFile)
+        for view_name, config in viewBlocks:
+            parsed = View.parseConfig(config)
             aclName = parsed[0]
             otherConfig = parsed[1]
             view = View(view_name, aclName, otherConfig)
@@ -192,39 +594,48 @@ class ViewGroup:
         else:
             raise ViewExistsException(group[view.name])
 
-    def locateLine(self, lines, pattern):
-        """ Return the index number of the matching line
-        None will be returned if none match.
-        """
-        n = None
-        for idx, line in enumerate(lines):
-            if re.search(pattern, line):
-                n = idx
-                break
-        return n
-
     def preproc(self, dbFile):
-        """ Process the dbFile, return a list of bytes,
-        each bytes contains all config data of a view,
-        without the leading 'view' keyword.
+        """ Map the dbFile into memory, return a list of
+        tuples, each contains the name of a view, and a
+        memoryview of the config lines of the view, from
+        the line after the 'view' line up to the line
+        before the ending '};'. The views are found by
+        scanViewDb. The lineage records above the first
+        view are loaded into self.lineage. Raise the
+        InvalidViewConfigException if there is anything
+        but a comment after the '{' of a view, or before
+        the '}' on its line, it's not in the lines.
         """
-        lines = open(dbFile, 'rb').read()
-        lines = lines.split(b'\n')
+        with open(dbFile, 'rb') as f:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file
+                raise InvalidViewConfigException
+        self.source = data      # keep the mapping with the group
+        buf = memoryview(data)
 
-        # remove all comment and empty lines above the first view
-        # and remove the leading keyword 'view' of the first view
-        n = self.locateLine(lines, b'^view\s')
-        if n is None:
+        blocks = []
+        for name, start, lbrace, rbrace, end in scanViewDb(data):
+            if not blocks:
+                for line in data[:start].split(b'\n'):
+                    self.lineage.parseLine(line)
+            lineEnd = data.find(b'\n', lbrace, rbrace)
+            if lineEnd < 0:
+                raise InvalidViewConfigException
+            bodyEnd = data.rfind(b'\n', lineEnd, rbrace) + 1
+            head    = data[lbrace + 1:lineEnd].strip()
+            if head and not head.startswith((b'#', b'//')):
+                raise InvalidViewConfigException
+            if data[bodyEnd:rbrace].strip():
+                raise InvalidViewConfigException
+            blocks.append((name, buf[lineEnd + 1:bodyEnd]))
+        if not blocks:
             raise InvalidViewConfigException
-        lines[n] = re.sub(b'^view\s', b'', lines[n])
-        lines   = lines[n:]
-        rawData = b'\n'.join(lines)
-        blocks  = re.split(b'\nview\s', rawData)
         return blocks
 
-    def writeOneView(self, view, ofile):
-        """ Format a code text for the view,
-        and write it to the ofile.
+    def formatView(self, view):
+        """ Format a code text for the view, return a list
+        of bytes-like objects which make up the text.
         """
         linePrefix  = '    '
         viewName    = view.name
@@ -237,29 +648,377 @@ class ViewGroup:
                         keyName,
                         aclName)
         tailer      = '};\n'
-        ba          = bytearray()
-        ba.extend(header.encode())
-        ba.extend(aclLine.encode())
-        ba.extend(b'\n'.join(otherConfig))  # a list of bytes objects
-        ba.extend(b'\n')
-        ba.extend(tailer.encode())
-        ba.extend(b'\n')
-        ofile.write(bytes(ba))
-
-    def save(self, dbFile):
-        """ Save the group data to a database file.
-        Views with LESS acl shall be put in front of
-        the one which is GREATER. The default view to
-        the bottom.
-        """
-        ofile = open(dbFile, 'wb')
-        for viewList in self.outData['ordered']:
-            for view in viewList:
-                self.writeOneView(view, ofile)
-        for view in self.outData['free']:
-            self.writeOneView(view, ofile)
+        text        = [(header + aclLine).encode()]
+        if len(otherConfig):
+            text.append(otherConfig)    # a slice of the source
+        else:
+            text.append(b'\n')
+        text.append((tailer + '\n').encode())
+        return text
+
+    def writeOneView(self, view, ofile):
+        """ Format a code text for the view,
+        and write it to the ofile.
+        """
+        ofile.writelines(self.formatView(view))
+
+    # a block of the view database is a view
+    blockDb = ViewBlockDb()
+
+    def outputViews(self, weighted=True):
+        """ Return a list of all views in the order they shall
+        be saved. Views with LESS acl are put in front of the
+        one which is GREATER, the default view to the bottom.
+        To keep the output stable from run to run, every ordered
+        list is put in its canonical order, the lists are sorted
+        by the name of their first view, and the free views by
+        their names. If the query counts of the views are known
+        in self.weights, and 'weighted' is True, all views are
+        put in the order of the weightedOrder method instead.
+        """
+        views = []
+        if self.weights and weighted:
+            for viewList in self.outData['ordered'].values():
+                views.extend(viewList)
+            views.extend(self.outData['free'])
+            views = self.weightedOrder(views)
+        else:
+            ordered = [self.canonicalOrder(x)
+                            for x in self.outData['ordered'].values()]
+            ordered.sort(key=(lambda x: x[0].name))
+            for viewList in ordered:
+                views.extend(viewList)
+            views.extend(sorted(self.outData['free'], key=(lambda x: x.name)))
         if self.defaultView is not None:
-            self.writeOneView(self.defaultView, ofile)
+            views.append(self.defaultView)
+        return views
+
+    def lessGraph(self, viewList):
+        """ Return the LESS relation of the views, as a dict
+        of the view names to the names of the views GREATER
+        than it, and a dict of the view names to the number
+        of the views LESS than it. Networks never partially
+        overlap, so the networks of all views are swept in
+        the order of (first address, -last address), a
+        network is LESS than the one right below it in the
+        stack, which is enough to build the whole relation.
+        """
+        owners = {}     # (firstInt, lastInt) -> names of the views
+        for view in viewList:
+            for net in self.acls[view.aclName].networks():
+                key = (net.firstInt, net.lastInt)
+                owners.setdefault(key, set()).add(view.name)
+
+        after  = dict([(x.name, set()) for x in viewList])
+        before = dict([(x.name, 0) for x in viewList])
+        stack  = []
+        for key in sorted(owners, key=(lambda x: (x[0], -x[1]))):
+            while stack and stack[-1][1] < key[0]:
+                stack.pop()
+            if stack:
+                for less in owners[key]:
+                    for greater in owners[stack[-1]] - after[less]:
+                        if greater != less:
+                            after[less].add(greater)
+                            before[greater] += 1
+            stack.append(key)
+        return (after, before)
+
+    def topoOrder(self, viewList, key):
+        """ Return the views in an order that every view comes
+        after the views LESS than it, among the views whose LESS
+        ones are all taken, the one of the smallest key is taken
+        first, the key is a function of the view name.
+        """
+        views = dict([(x.name, x) for x in viewList])
+        after, before = self.lessGraph(viewList)
+        res   = []
+        ready = [(key(x), x) for x, n in before.items() if n == 0]
+        heapq.heapify(ready)
+        while ready:
+            name = heapq.heappop(ready)[1]
+            res.append(views[name])
+            for greater in after[name]:
+                before[greater] -= 1
+                if before[greater] == 0:
+                    heapq.heappush(ready, (key(greater), greater))
+        assert len(res) == len(viewList), "view order error"
+        return res
+
+    def canonicalOrder(self, viewList):
+        """ Return the views of the viewList in an order that
+        only depends on the views and their acls, not on the
+        order they were placed: among the views whose LESS
+        ones are all taken, the one of the smallest name is
+        taken first.
+        """
+        return self.topoOrder(viewList, (lambda x: x))
+
+    def compact(self, aclGroup):
+        """ Merge the sibling parts of the split views back, the
+        views whose acls are two sibling parts, like A-0 and A-1,
+        and have the same config, are merged, along with the two
+        acls, unless the merged acl can not coexist with others,
+        or the merged view has to be both in front of and behind
+        another view. The acls of the views shall be top acls of
+        the aclGroup. Merging is repeated since two merged views
+        may be siblings too. Return the number of merges.
+        """
+        count = 0
+        while True:
+            pairs = self.compactPairs(aclGroup)
+            if not pairs:
+                return count
+            for view0, view1, name, aclName in pairs:
+                self.mergeViews(view0, view1, name, aclName)
+            count += len(pairs)
+
+    def compactPairs(self, aclGroup):
+        """ Return a list of (view0, view1, name, aclName) of
+        the views that can be merged now, and the names of the
+        merged view and acl.
+        A view is merged at most once in a call, the result of
+        a merge is checked together with the other merges.
+        """
+        views  = dict([(x.name, x) for x in self.data])
+        byAcl  = dict([(x.aclName, x.name) for x in self.data])
+        after, before = self.lessGraph(self.data)
+
+        # relations of the acls, 1 for LESS, 2 for GREATER
+        tops, relations = aclGroup.findRelations()
+        rela = dict([(x.name, {}) for x in tops])
+        for (acl1, acl2), (l_rela, g_rela) in relations.items():
+            bits = (1 if l_rela else 0) | (2 if g_rela else 0)
+            rela[acl1.name][acl2.name] = bits
+            rela[acl2.name][acl1.name] = (bits & 1) << 1 | (bits & 2) >> 1
+
+        # views merged in this call, as groups
+        owner   = dict([(x, x) for x in views])
+        members = dict([(x, [x]) for x in views])
+        def successors(group):
+            res = set()
+            for name in members[group]:
+                res |= set([owner[x] for x in after[name]])
+            res.discard(group)
+            return res
+        def reaches(src, dst):
+            """ A path of two steps or more from src to dst
+            """
+            seen  = set([src, dst])
+            queue = [x for x in successors(src) if x not in seen]
+            seen.update(queue)
+            while queue:
+                group = queue.pop()
+                for x in successors(group):
+                    if x == dst:
+                        return True
+                    if x not in seen:
+                        seen.add(x)
+                        queue.append(x)
+            return False
+
+        # sibling acls of the views, see Lineage.mergedName
+        lineage = self.aclLineage
+        siblings = []
+        for aclName in byAcl:
+            aclName0 = lineage.siblingOf(aclName)
+            if aclName0 in byAcl:
+                merged = lineage.mergedName(aclName0, aclName)
+                siblings.append((aclName0, aclName, merged))
+
+        res = []
+        for aclName0, aclName1, aclName in sorted(siblings,
+                                        key=(lambda x: (-len(x[0]), x[0]))):
+            name0 = byAcl[aclName0]
+            name1 = byAcl[aclName1]
+            if owner[name0] != name0 or owner[name1] != name1:
+                continue
+            view0, view1 = views[name0], views[name1]
+            acl0, acl1   = self.acls[aclName0], self.acls[aclName1]
+            if acl0.parent is not None or acl1.parent is not None:
+                continue
+            if bytes(view0.otherConfig) != bytes(view1.otherConfig):
+                continue
+            name = self.mergedViewName(view0, view1, aclName)
+            if name is None:
+                continue
+            if name in views and name not in (name0, name1):
+                continue
+
+            # the acls, OR the relations to every other group
+            found = {}
+            for acl in (acl0, acl1):
+                for other, bits in rela[acl.name].items():
+                    if other in (acl0.name, acl1.name):
+                        continue
+                    group = owner.get(byAcl.get(other), other)
+                    found[group] = found.get(group, 0) | bits
+            if 3 in found.values():
+                continue
+
+            # the views, no path from one to the other through others
+            if reaches(name0, name1) or reaches(name1, name0):
+                continue
+
+            owner[name1] = name0
+            members[name0].extend(members.pop(name1))
+            res.append((view0, view1, name, aclName))
+        return res
+
+    def mergedViewName(self, view0, view1, aclName):
+        """ The name of the view merged from view0 and view1,
+        whose acl is named 'aclName'. The views are taken as
+        siblings like the acls, see Lineage.mergedName, if
+        they are not, the merged view is named after its acl,
+        unless either one is recorded as a part of a view,
+        None is returned then, they are not to be merged.
+        """
+        name = self.lineage.mergedName(view0.name, view1.name)
+        if name is not None:
+            return name
+        if view0.name in self.lineage.origin or view1.name in self.lineage.origin:
+            return None
+        return aclName
+
+    def mergeViews(self, view0, view1, name, aclName):
+        """ Merge the two views and their acls into one view of
+        the 'name', with the acl of the 'aclName', record the
+        merges in the lineages.
+        """
+        acl0, acl1 = self.acls[view0.aclName], self.acls[view1.aclName]
+        for acl in (acl0, acl1):
+            for node in [acl] + acl.childNodes:
+                if isinstance(node, Acl):
+                    self.forgetAcl(node)
+        acl = Acl.mergeTree(acl0, acl1, aclName, self.aclLineage)
+        self.rememberAcl(acl)
+        self.data.remove(view0)
+        self.data.remove(view1)
+        self.data.append(View(name, acl.name, view0.otherConfig))
+        recorded = view0.name in self.lineage.origin or view1.name in self.lineage.origin
+        if not self.lineage.merge(view0.name, view1.name, name) and recorded:
+            raise Exception("%s and %s are not parts of one view" % (
+                                view0.name, view1.name))
+
+    def forgetAcl(self, acl):
+        """ Remove the acl and its sub acls from self.acls
+        """
+        self.acls.pop(acl.name, None)
+        for node in acl.childNodes:
+            if isinstance(node, Acl):
+                self.forgetAcl(node)
+
+    def rememberAcl(self, acl):
+        """ Add the acl and its sub acls to self.acls
+        """
+        self.acls[acl.name] = acl
+        for node in acl.childNodes:
+            if isinstance(node, Acl):
+                self.rememberAcl(node)
+
+    def orderByGraph(self):
+        """ Put all views to self.outData in the order of the
+        LESS relation, without splitting any view, the views
+        related to none are free, others are ordered in lists
+        of related views. Raise an exception if there is a
+        view that has to be both in front of and behind
+        another one.
+        """
+        after, before = self.lessGraph(self.data)
+        owner = dict([(x.name, x.name) for x in self.data])
+        def find(x):
+            while owner[x] != x:
+                owner[x] = owner[owner[x]]
+                x = owner[x]
+            return x
+        for name, greaters in after.items():
+            for greater in greaters:
+                owner[find(greater)] = find(name)
+
+        groups = {}
+        for view in self.data:
+            groups.setdefault(find(view.name), []).append(view)
+        self.outData['free']    = {}
+        self.outData['ordered'] = {}
+        for viewList in groups.values():
+            if len(viewList) == 1:
+                self.outData['free'][viewList[0]] = True
+            else:
+                ordered = self.canonicalOrder(viewList)
+                self.outData['ordered'][self.listSerial] = ordered
+                self.listSerial += 1
+
+    def weightOf(self, view):
+        """ Return the query count of the view in self.weights,
+        which is keyed by the name of the view, or its acl, or
+        the original ones of them if they were split.
+        """
+        names = [view.name, self.lineage.origin.get(view.name),
+                 view.aclName, self.aclLineage.origin.get(view.aclName)]
+        for name in names:
+            if name in self.weights:
+                return self.weights[name]
+        return 0
+
+    def weightedOrder(self, viewList):
+        """ Return the views in an order that the views of more
+        queries come first, which BIND tests earlier, as long as
+        the views LESS than them are in front. A view is given
+        the best density, the weight per view, of itself along
+        with a line of views GREATER than it, thus a light view
+        which must be in front of a heavy one is taken early,
+        but not a long line of light views.
+        """
+        weights   = dict([(x.name, self.weightOf(x)) for x in viewList])
+        after, before = self.lessGraph(viewList)
+        density   = {}
+        chain     = {}  # name -> (weight, length) of the best line
+        for view in reversed(self.canonicalOrder(viewList)):
+            best = (weights[view.name], 1)
+            for greater in after[view.name]:
+                w, n = chain[greater]
+                cand = (weights[view.name] + w, n + 1)
+                if cand[0] * best[1] > best[0] * cand[1]:
+                    best = cand
+            chain[view.name]   = best
+            density[view.name] = best[0] / best[1]
+        return self.topoOrder(viewList,
+                    (lambda x: (-density[x], -weights[x], x)))
+
+    def matchCost(self, views):
+        """ Return the average number of views BIND tests for a
+        query, if the views are in the given order, None if no
+        query count is known.
+        """
+        total = sum([self.weightOf(x) for x in views])
+        if not total:
+            return None
+        cost = sum([self.weightOf(x) * i for i, x in enumerate(views, 1)])
+        return cost / total
+
+    def save(self, dbFile, compareTo=None, keepLayout=False):
+        """ Save the group data to a database file, in the
+        order of the outputViews method. The lineage of the
+        views is written on top of the file. Every view is
+        compared with the one in the compareTo file or the
+        existing dbFile, a report of the changed views is
+        returned, see BlockDb.save for the details, and the
+        'keepLayout' argument. The data is written to a temporary
+        file which then replaces the dbFile, the dbFile may
+        be the mapped source of the views.
+        """
+        blocks = [(x.name, self.formatView(x)) for x in self.outputViews()]
+        return self.blockDb.save(dbFile, self.lineage.format(), blocks,
+                                 compareTo=compareTo,
+                                 keepLayout=keepLayout)
+
+    def saveLookupTable(self, path):
+        """ Save the lookup table of the views in the order of
+        the outputViews method, see LookupTable. Return the
+        number of the address ranges.
+        """
+        views = [x for x in self.outputViews() if x is not self.defaultView]
+        return LookupTable.save(path, views, self.acls, self.defaultView)
 
     def resolveViewsParts(self):
         """ Find out all views whose acl is missing (been
@@ -275,6 +1034,7 @@ class ViewGroup:
             else:
                 self.data.remove(view)
                 self.data.extend(newViews)
+                self.lineage.replace(view.name, [x.name for x in newViews])
 
     def resolveOneViewParts(self, view):
         """ A view's acl may be split into parts in a
@@ -295,11 +1055,18 @@ class ViewGroup:
         statement is identical, since these different
         views all use the same data in the database.
 
+        The parts are looked up in self.aclLineage, the
+        names are scanned only for an acl which is split
+        by a version that didn't record the lineage.
+
         This method shall not be call if the acl which
         the 'view' connects already exists in self.acls.
         """
-        flag     = view.aclName + '-'
-        names    = [x for x in self.acls if x.startswith(flag)]
+        names = self.aclLineage.parts(view.aclName)
+        if names is None:
+            flag  = view.aclName + '-'
+            names = [x for x in self.acls if x.startswith(flag)]
+        names    = [x for x in names if x in self.acls]
         newViews = []
         if len(names) > 1:
             for aclName in names:
@@ -307,48 +1074,157 @@ class ViewGroup:
                 newViews.append(newView)
         return newViews
 
-    def order(self):
+    def order(self, jobs=1, handler=None):
         """ Sort all views in the group, but not including
         the 'ANY' view which is the default and shall not
         be put together to sort, it shall always be the
-        last one in the view config database.
+        last one in the view config database. Unless 'jobs'
+        is 1, the views are ordered by components in at most
+        'jobs' worker processes, None for the number of CPUs,
+        see the orderComponents method. The order conflicts
+        are passed to the 'handler' instead of orderHandler
+        if it's given, it's called in this process, thus the
+        views are ordered serially then.
         """
         views = list(self.data)
         self.enforceRules(views)
+        if handler is not None:
+            self.orderHandler = handler
+            jobs = 1
+        if jobs != 1:
+            self.orderComponents(views, jobs)
+        else:
+            for view in views:
+                self.placeView(view)
+
+    def components(self, views):
+        """ Divide the views into components, views of one
+        component overlap each other directly or through
+        others in the component, or share the acl, views of
+        different components never overlap. Return a list
+        of the components, each is a list of the views in
+        the original order.
+        """
+        owner = dict([(x.name, x.name) for x in views])
+        def find(x):
+            while owner[x] != x:
+                owner[x] = owner[owner[x]]
+                x = owner[x]
+            return x
+        after, before = self.lessGraph(views)
+        for name, greaters in after.items():
+            for greater in greaters:
+                owner[find(greater)] = find(name)
+        byAcl = {}
+        for view in views:
+            other = byAcl.setdefault(view.aclName, view.name)
+            owner[find(view.name)] = find(other)
+
+        res = {}
         for view in views:
-            self.placeView(view)
+            res.setdefault(find(view.name), []).append(view)
+        return list(res.values())
+
+    def orderComponents(self, views, jobs=None):
+        """ Place the views component by component, every
+        component of more than one view is placed in a worker
+        process, along with the acl trees of its views, then
+        the results are put together. Views of one component
+        are placed in the same order as they are placed all
+        together, and the parts are named after the split
+        views and acls, thus the result is the same as the
+        serial one. The view configs stay in this process,
+        the views are sent with the index of the config.
+        The acls of the components are replaced by the ones
+        sent back, the networks of them in self.acls too, it's
+        the data of the AclGroup when they share it.
+        """
+        configs = []
+        tasks   = []
+        tops    = {}    # top acl -> index of the task
+        for viewList in self.components(views):
+            if len(viewList) == 1:
+                self.placeView(viewList[0])
+                continue
+            shipped = []
+            for view in viewList:
+                tops[self.acls[view.aclName]] = len(tasks)
+                shipped.append(View(view.name, view.aclName, len(configs)))
+                configs.append(view.otherConfig)
+            tasks.append((shipped, {}, self.verbose))
+        if not tasks:
+            return
+        for name, node in self.acls.items():
+            if isinstance(node, Acl):
+                top = node.topParent() or node
+                if top in tops:
+                    tasks[tops[top]][1][name] = node
+
+        with multiprocessing.Pool(jobs) as pool:
+            results = pool.map(orderComponent, tasks, chunksize=1)
+        for task, result in zip(tasks, results):
+            (outData, acls, viewEvents, aclEvents,
+                    pushed, maxDepth, cacheStats, spans) = result
+            for name in task[1]:
+                self.acls.pop(name)
+            self.acls.update(acls)
+            for acl in acls.values():
+                for node in acl.childNodes:
+                    if isinstance(node, Network):
+                        self.acls[node.name] = node
+            self.lineage.replay(viewEvents)
+            self.aclLineage.replay(aclEvents)
+            for view in outData['free']:
+                view.otherConfig = configs[view.otherConfig]
+                self.outData['free'][view] = True
+            for viewList in outData['ordered'].values():
+                for view in viewList:
+                    view.otherConfig = configs[view.otherConfig]
+                self.outData['ordered'][self.listSerial] = viewList
+                self.listSerial += 1
+            self.queue.pushed  += pushed
+            self.queue.maxDepth = max(self.queue.maxDepth, maxDepth)
+            self.relations.add(*cacheStats)
+            if Tracer.current is not None:
+                Tracer.current.events.extend(spans)
 
     def placeView(self, begin_view):
         """ Place the view to an appropricate location,
         according to the order rule. On failure, split
-        the view and its acl, and start over.
-        """
-        views = {begin_view.name: begin_view}
-        while views:
-            viewName = list(views.keys())[0]
-            viewObj  = views.pop(viewName)
-            if self.verbose >= 1:
-                print("placing view %s" % viewName)
-            try:
-                self.insertView(viewObj)
-            except ViewOrderException as e:     # split and retry
+        the view and its acl, the parts are pushed to
+        the work queue and placed in turn.
+        """
+        queue = self.queue
+        queue.push(begin_view)
+        with Tracer.begin('placeView', 'view', view=begin_view.name):
+            for viewObj in queue:
                 if self.verbose >= 1:
-                    print("splitting view %s" % viewName)
-                self.orderExceptionHandler(e=e, viewObj=viewObj, views=views)
+                    print("placing view %s" % viewObj.name)
+                with Tracer.begin('insertView', 'view', view=viewObj.name,
+                                  acl=viewObj.aclName) as insert:
+                    conflict = self.insertView(viewObj)
+                    if insert and conflict is not None:
+                        insert.args['conflict'] = len(conflict.data)
+                if conflict is not None:    # split and retry
+                    if self.verbose >= 1:
+                        print("splitting view %s" % viewObj.name)
+                    self.orderHandler(conflict=conflict, viewObj=viewObj,
+                                      queue=queue)
 
-    def orderExceptionHandler(self, *junk, e, viewObj, views):
-        """ Handler for order exception, to split the acl and the view.
+    def orderHandler(self, *junk, conflict, viewObj, queue):
+        """ Handler for order conflict, to split the acl and the view.
         """
-        nets = e.args[0]
+        nets = conflict.data
         oldAclName = viewObj.aclName    # get name befor split
-        oldAcl0, oldAcl1 = Acl.splitTree(nets)
+        oldAcl0, oldAcl1 = Acl.splitTree(nets, self.aclLineage)
         self.acls.pop(oldAclName)       # remove the old name
         self.acls[oldAcl0.name] = oldAcl0
         self.acls[oldAcl1.name] = oldAcl1
         for suffix, aclName in [('-0', oldAcl0.name), ('-1', oldAcl1.name)]:
-            name        = viewObj.name + suffix
-            newView     = View(name, aclName, viewObj.otherConfig)
-            views[name] = newView
+            name    = viewObj.name + suffix
+            newView = View(name, aclName, viewObj.otherConfig)
+            queue.push(newView)
+        self.lineage.split(viewObj.name, viewObj.name + '-0', viewObj.name + '-1')
 
     def insertView(self, newView):
         """ Find a good location in the self.outData, and
@@ -360,25 +1236,26 @@ class ViewGroup:
         SHALL BE PLACED FIRST, THEN THE GREATER ONE.
 
         If it's impossible to pick a location that complies
-        to the order rule, raise an exception. It's possible
-        that the exception raised halfway at which point
-        some views may had already been moved from their
-        original position, thus corrupt the view group, to
-        prevent it, we make shallow copies of the groups,
-        and process the copies, after all existing views had
-        been processed, we update the view group with the
-        processed copies.
-
-        If a list in the orderedGroups has a view LESS or
+        to the order rule, return a Conflict which carries the
+        networks to split, otherwise None. To not corrupt the
+        view group when the conflict is found halfway, the
+        work is done in two phases: first, all existing views
+        are examined without changing anything, the views and
+        lists to be moved are only noted down; then, when no
+        conflict found, the noted ones are moved, which takes
+        time in proportion to the views actually moved.
+
+        If a list in the ordered group has a view LESS or
         GREATER than the newView, the same will be deleted,
         all views in it will be moved to a new list. If a
-        view in the freeViews group LESS or GREATER than
-        the newView, the same will be moved to a new list.
+        view in the free group LESS or GREATER than the
+        newView, the same will be moved to a new list.
         """
-        freeViews     = list(self.outData['free'])
-        orderedGroups = [list(l) for l in self.outData['ordered']]
-        intactGroups  = []  # holds the view lists that have
-                            # no relationship with the newView
+        freeViews     = self.outData['free']
+        orderedGroups = self.outData['ordered']
+        movedFree     = []  # holds the free views to be moved
+        movedGroups   = []  # holds the keys of the view lists that
+                            # have relationship with the newView
         globalL       = []  # holds all views that LESS than the newView
         globalR       = []  # holds all views that GREATER than the newView
         newAcl        = self.acls[newView.aclName]
@@ -388,33 +1265,36 @@ class ViewGroup:
         gGroup    = []
         for existView in freeViews:
             existAcl = self.acls[existView.aclName]
-            rela     = existAcl.compare(newAcl)
+            rela     = self.relations.compare(existAcl, newAcl)
             if rela == Acl.LESS:
                 lGroup.append(existView)
             elif rela == Acl.GREATER:
                 gGroup.append(existView)
-        for v in (lGroup + gGroup):
-            freeViews.remove(v)
+        movedFree.extend(lGroup + gGroup)
         globalL.extend(lGroup)
         globalR.extend(gGroup)
 
         # the ordered category
-        for viewList in orderedGroups:
+        for key, viewList in orderedGroups.items():
             lessLen = 0
+            related = False
             lGroup  = []
             gGroup  = []
             for existView in viewList:
                 existAcl = self.acls[existView.aclName]
-                rela     = existAcl.compare(newAcl)
+                rela     = self.relations.compare(existAcl, newAcl)
                 if rela == Acl.LESS:
                     lessLen += 1
+                    related  = True
                 elif rela == Acl.GREATER:
-                    lGroup = viewList[:lessLen]
-                    gGroup = viewList[lessLen:]
+                    lGroup  = viewList[:lessLen]
+                    gGroup  = viewList[lessLen:]
+                    related = True
                     break
                 else:
                     lessLen += 1
             else:
+                if related:
                     lGroup = viewList[:lessLen]
             # at this point, all views in the lGroup are
             # LESS than the newView (its acl actually), but
@@ -422,44 +1302,39 @@ class ViewGroup:
             # than the newView, all subsequent ones are
             # undetermined. The next step is to found out if
             # there is any view in the gGroup that is LESS
-            # than the newView, in which case we will raise
-            # an exception because the rule is violated.
+            # than the newView, in which case we will return
+            # a conflict because the rule is violated.
             for existView in gGroup:
                 existAcl = self.acls[existView.aclName]
-                rela     = existAcl.compare(newAcl)
+                rela     = self.relations.compare(existAcl, newAcl)
                 if rela == Acl.LESS:
                     # attach the greater nets of the newAcl for split
                     nets = self.getNets(newAcl, existAcl, Network.GREATER)
-                    raise ViewOrderException(nets)
-            if len(lGroup) == 0 and len(gGroup) == 0:
-                intactGroups.append(viewList)
-            else:
+                    return Conflict(nets)
+            if related:
+                movedGroups.append(key)
                 globalL.extend(lGroup)
                 globalR.extend(gGroup)
 
+        # nothing has been changed so far, commit the moves
         if len(globalL) == 0 and len(globalR) == 0:
-            self.outData['free'].append(newView)
+            freeViews[newView] = True
         else:
-            self.outData['free'] = freeViews
-            self.outData['ordered'] = []
-            self.outData['ordered'].extend(intactGroups)
+            for view in movedFree:
+                del freeViews[view]
+            for key in movedGroups:
+                del orderedGroups[key]
             newList = globalL + [newView] + globalR
-            self.outData['ordered'].append(newList)
+            orderedGroups[self.listSerial] = newList
+            self.listSerial += 1
+        return None
 
     def getNets(self, acl1, acl2, relation):
         """ Compare acl1 and acl2, and find all networks
         in acl1 that has 'relation' relationship with
         networks in acl2.
         """
-        nets  = []
-        nets1 = acl1.networks()
-        nets2 = acl2.networks()
-        for net1 in nets1:
-            for net2 in nets2:
-                if relation == net1.compare(net2):
-                    nets.append(net1)
-                    break
-        return nets
+        return self.relations.nets(acl1, acl2, relation)
 
     def enforceRules(self, views):
         """ Raise an exception if any violation detected